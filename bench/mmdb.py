@@ -0,0 +1,112 @@
+# Minimal MaxMind DB writer for benchmarks.
+#
+# Writes an IPv4 GeoLite2-City-like database mapping every /8 network to a
+# record with country ISO code and location, which is enough for
+# pud.modules.peerstats.geo.GeoCache. See
+# https://maxmind.github.io/MaxMind-DB/ for the format.
+
+import struct
+import time
+
+
+COUNTRIES = [('UA', 50.45, 30.52), ('US', 38.89, -77.03),
+             ('DE', 52.52, 13.40), ('FR', 48.85, 2.35),
+             ('JP', 35.68, 139.69), ('BR', -15.79, -47.88),
+             ('IN', 28.61, 77.20), ('PL', 52.22, 21.01)]
+METADATA_MARKER = b'\xab\xcd\xefMaxMind.com'
+RECORD_SIZE = 24
+# Depth of the search tree. Networks are /DEPTH.
+DEPTH = 8
+
+
+# Integers of the given MMDB type. Plain ints are encoded with the
+# smallest unsigned type, but readers check types of metadata fields.
+class UInt32(int):
+    pass
+
+
+class UInt64(int):
+    pass
+
+
+def control(type, size):
+    if type <= 7:
+        return bytes([type << 5 | size])
+
+    return bytes([size, type - 7])
+
+
+def encode(v):
+    if isinstance(v, str):
+        b = v.encode('utf-8')
+        return control(2, len(b)) + b
+    if isinstance(v, float):
+        return control(3, 8) + struct.pack('>d', v)
+    if isinstance(v, dict):
+        return control(7, len(v)) + b''.join(encode(k) + encode(x)
+                                              for k, x in v.items())
+    if isinstance(v, list):
+        return control(11, len(v)) + b''.join(encode(x) for x in v)
+    if isinstance(v, int):
+        b = v.to_bytes(8, 'big').lstrip(b'\0')
+        if isinstance(v, UInt64) or v >= 2 ** 32:
+            return control(9, len(b)) + b
+        if isinstance(v, UInt32) or v >= 2 ** 16:
+            return control(6, len(b)) + b
+        return control(5, len(b)) + b
+
+    raise TypeError('unsupported type: {}'.format(type(v)))
+
+
+def record(country, lat, lon):
+    return {'country': {'iso_code': country},
+            'location': {'latitude': lat, 'longitude': lon}}
+
+
+# Networks which have no record in the database.
+def missing(net):
+    return net % 16 == 15
+
+
+def write(path):
+    data = b''
+    offsets = []
+    for c in COUNTRIES:
+        offsets.append(len(data))
+        data += encode(record(*c))
+
+    # Full binary tree over the first DEPTH bits, nodes numbered in
+    # breadth-first order. Records of the last level point to data.
+    nodes = 2 ** DEPTH - 1
+    first_leaf = 2 ** (DEPTH - 1) - 1
+    tree = []
+    for n in range(nodes):
+        recs = []
+        for bit in (0, 1):
+            child = 2 * n + 1 + bit
+            if n < first_leaf:
+                recs.append(child)
+                continue
+            net = child - nodes
+            if missing(net):
+                recs.append(nodes)
+            else:
+                recs.append(nodes + 16 + offsets[net % len(COUNTRIES)])
+        tree.append(recs[0].to_bytes(3, 'big') + recs[1].to_bytes(3, 'big'))
+
+    meta = encode({'node_count': UInt32(nodes),
+                   'record_size': RECORD_SIZE,
+                   'ip_version': 4,
+                   'database_type': 'GeoLite2-City',
+                   'languages': ['en'],
+                   'binary_format_major_version': 2,
+                   'binary_format_minor_version': 0,
+                   'build_epoch': UInt64(time.time()),
+                   'description': {'en': 'pud benchmark database'}})
+
+    with open(path, 'wb') as f:
+        f.write(b''.join(tree))
+        f.write(b'\0' * 16)
+        f.write(data)
+        f.write(METADATA_MARKER)
+        f.write(meta)
@@ -0,0 +1,44 @@
+# RunQueue tick cost microbenchmark.
+#
+#     python3 -m bench.runqueue [ticks]
+#
+# Registers N second-level crons with different phases and measures the
+# average time spent in RunQueue.next() per tick. With the heap-based queue
+# the cost stays roughly flat as N grows from 10 to 10000.
+
+import sys
+import time
+import croniter
+from pud.pud import RunQueue, CronTask
+
+
+SIZES = [10, 100, 1000, 10000]
+
+
+def crons(n):
+    start = time.time()
+    crons = []
+    for i in range(n):
+        expr = croniter.croniter('* * * * * */{}'.format(i % 59 + 1), start)
+        crons.append(CronTask('cron{}'.format(i), None, expr, None))
+
+    return crons
+
+
+def bench(n, ticks):
+    runq = RunQueue(crons(n))
+    start = time.perf_counter()
+    for _ in range(ticks):
+        runq.next()
+
+    return (time.perf_counter() - start) / ticks
+
+
+def main():
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for n in SIZES:
+        print('{:>6} crons: {:8.2f} us/tick'.format(n, bench(n, ticks) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
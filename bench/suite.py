@@ -0,0 +1,257 @@
+# Scheduler and config micro-benchmark suite.
+#
+#     python3 -m bench.suite [-k name] [--check] [--no-record]
+#
+# Runs benchmarks of the core hot paths and appends results to a JSON lines
+# history file (bench/history.jsonl by default). Every result is compared
+# with the median of the previous runs recorded on the same host, a result
+# slower by more than --threshold is reported as a regression. With
+# --check the exit code is 1 if any regression is found.
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import platform
+import statistics
+import subprocess
+import logging
+import threading
+import croniter
+import pud
+import pud.pud
+import pud.pool
+import pud.config
+from bench.runqueue import crons
+
+
+HISTORY = os.path.join(os.path.dirname(__file__), 'history.jsonl')
+THRESHOLD = 0.2
+WINDOW = 5
+REPEAT = 5
+
+
+# Returns the best time per operation in microseconds out of `repeat`
+# runs of func, which performs `n` operations.
+def best(func, n, repeat=REPEAT):
+    ts = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(n)
+        ts.append(time.perf_counter() - start)
+
+    return min(ts) / n * 1e6
+
+
+def bench_runqueue(size):
+    def run(n):
+        for _ in range(n):
+            runq.next()
+
+    runq = pud.pud.RunQueue(crons(size))
+
+    return lambda scale: best(run, 2000 * scale)
+
+
+def bench_croniter(expr):
+    def run(n):
+        it = croniter.croniter(expr, time.time())
+        for _ in range(n):
+            it.get_next()
+
+    return lambda scale: best(run, 2000 * scale)
+
+
+# Parses a configuration file of `lines` properties of all value types.
+def bench_config(lines):
+    def run(n):
+        for _ in range(n):
+            pud.config.parse(path)
+
+    def measure(scale):
+        try:
+            return best(run, scale)
+        finally:
+            os.remove(path)
+
+    fd, path = tempfile.mkstemp(suffix='.conf')
+    with os.fdopen(fd, 'w') as f:
+        f.write('module = "bench"\n')
+        for i in range(lines):
+            f.write('# comment {}\n'.format(i))
+            f.write('str.{0} = "value {0}"\n'.format(i))
+            f.write('int.{0} = {0}\n'.format(i))
+            f.write('bool.{} = true\n'.format(i))
+
+    return measure
+
+
+class Module(pud.Module):
+    pass
+
+
+# Module class with `crons` cron methods, `tasks` long tasks and `plain`
+# ordinary methods.
+def module(crons, tasks, plain):
+    attrs = {}
+    for i in range(crons):
+        attrs['cron{}'.format(i)] = pud.cron('* * * * *')(lambda self: None)
+    for i in range(tasks):
+        attrs['task{}'.format(i)] = pud.task(lambda self: None)
+    for i in range(plain):
+        attrs['method{}'.format(i)] = lambda self: None
+    cls = type('BenchModule', (Module,), attrs)
+
+    return cls(pud.pud.term, None, pud.config.Config(None))
+
+
+def bench_discovery(crons, tasks, plain):
+    def run(n):
+        for _ in range(n):
+            pud.pud.module_tasks(mod)
+            pud.pud.module_crons(mod)
+
+    mod = module(crons, tasks, plain)
+
+    return lambda scale: best(run, 20 * scale)
+
+
+# Median delay between CronTask.fire() and the start of the cron method
+# on an idle worker pool.
+def bench_dispatch():
+    def measure(scale):
+        pool = pud.pool.Pool(4)
+        started = threading.Event()
+        delays = []
+
+        def method():
+            delays.append(time.perf_counter() - fired)
+            started.set()
+
+        c = pud.pud.CronTask('bench.dispatch', method,
+                             croniter.croniter('* * * * *'), pool)
+        try:
+            for _ in range(200 * scale):
+                started.clear()
+                fired = time.perf_counter()
+                c.fire(time.time())
+                started.wait(1)
+                while c.isbusy():
+                    time.sleep(0)
+        finally:
+            pool.close(1)
+
+        return statistics.median(delays) * 1e6
+
+    return measure
+
+
+BENCHMARKS = [
+    ('runqueue.next.10', lambda: bench_runqueue(10)),
+    ('runqueue.next.1000', lambda: bench_runqueue(1000)),
+    ('runqueue.next.10000', lambda: bench_runqueue(10000)),
+    ('croniter.minutes', lambda: bench_croniter('*/5 * * * *')),
+    ('croniter.seconds', lambda: bench_croniter('* * * * * */10')),
+    ('config.parse.10000', lambda: bench_config(10000)),
+    ('module.discovery', lambda: bench_discovery(20, 5, 200)),
+    ('cron.dispatch', bench_dispatch),
+]
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=os.path.dirname(__file__),
+                              capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def history(path, host):
+    runs = []
+    if not os.path.exists(path):
+        return runs
+    with open(path, 'r') as f:
+        for l in f:
+            try:
+                r = json.loads(l)
+            except ValueError:
+                continue
+            if r.get('host') == host:
+                runs.append(r)
+
+    return runs
+
+
+def baseline(runs, name, window):
+    vs = [r['results'][name] for r in runs if name in r.get('results', {})]
+    if not vs:
+        return None
+
+    return statistics.median(vs[-window:])
+
+
+def main():
+    p = argparse.ArgumentParser(description='Run pud micro-benchmarks.')
+    p.add_argument('-k', dest='filter', default='',
+                   help='run only benchmarks containing this string')
+    p.add_argument('--history', default=HISTORY,
+                   help='results history file')
+    p.add_argument('--no-record', action='store_true',
+                   help='do not append results to the history')
+    p.add_argument('--threshold', type=float, default=THRESHOLD,
+                   help='slowdown reported as a regression')
+    p.add_argument('--window', type=int, default=WINDOW,
+                   help='number of previous runs the baseline is taken of')
+    p.add_argument('--scale', type=int, default=1,
+                   help='iterations multiplier')
+    p.add_argument('--check', action='store_true',
+                   help='exit with code 1 on regressions')
+    args = p.parse_args()
+    logging.getLogger('pud').setLevel(logging.WARNING)
+
+    host = socket.gethostname()
+    runs = history(args.history, host)
+    results = {}
+    regressions = []
+    print('{:<24} {:>12} {:>12} {:>8}'.format('benchmark', 'us', 'baseline',
+                                              'change'))
+    for name, setup in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        measure = setup()
+        v = measure(args.scale)
+        results[name] = round(v, 3)
+
+        base = baseline(runs, name, args.window)
+        line = '{:<24} {:>12.3f}'.format(name, v)
+        if base:
+            change = v / base - 1
+            line += ' {:>12.3f} {:>+7.1f}%'.format(base, change * 100)
+            if change > args.threshold:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+
+    if not args.no_record and results:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps({'time': int(time.time()),
+                                'host': host,
+                                'commit': commit(),
+                                'python': platform.python_version(),
+                                'results': results}) + '\n')
+
+    if regressions:
+        print('Regressions: {}'.format(', '.join(regressions)))
+        if args.check:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
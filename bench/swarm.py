@@ -0,0 +1,297 @@
+# Synthetic swarm load generator for the PeerStats pipeline.
+#
+#     python3 -m bench.swarm [--torrents N] [--peers N] [--ticks N]
+#                            [--record FILE | --replay FILE]
+#
+# Runs PeerStats.update_stats ticks fully offline: torrent-get responses
+# are served by a local fake transmission-daemon, peers are geolocated with
+# a generated MMDB (see bench/mmdb.py) and rows are inserted into an
+# in-memory ClickHouse stand-in. Reports duration of every tick, rows per
+# second and memory allocated by a single tick.
+#
+# Responses are either generated (--torrents x --peers peers, --churn of
+# which get new addresses every tick) or replayed from a file with one
+# torrent-get response per line. --record saves generated responses in the
+# same format, so a swarm can be reproduced exactly, and responses captured
+# from a real busy server can be replayed with --replay.
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import statistics
+import collections
+import tracemalloc
+import http.server
+import pud.config
+import pud.spool
+import pud.sources
+import pud.modules.peerstats.sink
+from pud.modules.peerstats.peerstats import PeerStats
+from bench import mmdb
+
+
+CLIENTS = ['qBittorrent 4.{}.{}', 'Transmission 3.0{}', 'Transmission 4.0.{}',
+           'libTorrent (Rakshasa) 0.13.{}', 'Deluge 2.1.{}',
+           'BitComet 1.{}{}', 'uTorrent 3.5.{}', 'Tixati 3.{}',
+           'aria2 1.3{}.{}', 'BiglyBT 3.{}.{}']
+SID = 'bench'
+
+
+def client(rnd):
+    c = rnd.choice(CLIENTS)
+
+    return c.format(*[rnd.randrange(10) for _ in range(c.count('{}'))])
+
+
+def address(rnd):
+    return '{}.{}.{}.{}'.format(rnd.randrange(1, 224), rnd.randrange(256),
+                                rnd.randrange(256), rnd.randrange(1, 255))
+
+
+def peer(rnd, uploading):
+    return {'address': address(rnd),
+            'clientName': client(rnd),
+            'rateToPeer': rnd.randrange(1, 1 << 20),
+            'isUploadingTo': rnd.random() < uploading}
+
+
+# Yields `ticks` torrent-get responses in the table format. Every tick
+# `churn` part of peers is replaced with new ones.
+def swarm(torrents, peers, uploading, churn, ticks, seed):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(torrents):
+        rows.append(['{:040x}'.format(rnd.getrandbits(160)),
+                     'torrent {}'.format(i), '',
+                     [peer(rnd, uploading) for _ in range(peers)]])
+
+    for _ in range(ticks):
+        for r in rows:
+            ps = r[3]
+            for j in range(len(ps)):
+                if rnd.random() < churn:
+                    ps[j] = peer(rnd, uploading)
+                else:
+                    ps[j]['rateToPeer'] = rnd.randrange(1, 1 << 20)
+        yield json.dumps({'result': 'success', 'arguments': {
+            'torrents': [['hashString', 'name', 'comment', 'peers']] + rows}})
+
+
+# Fake transmission-daemon serving the given responses one by one, the
+# last response is repeated. Negotiates session id like the real one.
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, responses):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.responses = responses
+        self.requests = 0
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True, name='transmission')
+        self.thread.start()
+
+    def response(self):
+        r = self.responses[min(self.requests, len(self.responses) - 1)]
+        self.requests += 1
+
+        return r
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, so with Nagle's algorithm
+    # every response would wait for the delayed ACK of the client.
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('X-Transmission-Session-Id') != SID:
+            self.reply(409, b'')
+        else:
+            self.reply(200, self.server.response())
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('X-Transmission-Session-Id', SID)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# In-memory stand-in of clickhouse_driver.Client counting inserted rows
+# per table.
+class ClickHouse:
+    rows = collections.Counter()
+    lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def execute_iter(self, query, settings=None):
+        return iter(())
+
+    def execute(self, query, data=None, columnar=False):
+        n = len(data[0]) if columnar else len(data)
+        with self.lock:
+            self.rows[query.split()[2]] += n
+
+    def disconnect_connection(self):
+        pass
+
+
+def config(port, args, geofile):
+    cfg = pud.config.Config(None)
+    cfg.update({'module': 'peerstats',
+                'transmission.host': '127.0.0.1',
+                'transmission.port': port,
+                'transmission.ttl': 0,
+                'clickhouse.host': 'localhost',
+                'clickhouse.port': 9000,
+                'clickhouse.db': 'bench',
+                'rollup.raw': not args.no_raw,
+                'rollup.window': args.rollup,
+                'geolite.file': geofile})
+
+    return cfg
+
+
+def responses(args):
+    if args.replay:
+        with open(args.replay, 'rb') as f:
+            return [l for l in f.read().splitlines() if l.strip()]
+
+    rs = [r.encode('utf-8') for r in swarm(args.torrents, args.peers,
+                                           args.uploading, args.churn,
+                                           args.ticks + 1, args.seed)]
+    if args.record:
+        with open(args.record, 'wb') as f:
+            f.write(b'\n'.join(rs) + b'\n')
+
+    return rs
+
+
+# Runs a single tick and returns its duration and number of processed
+# peers. Every processed peer is looked up in the GeoIP cache once.
+def tick(mod):
+    lookups = sum(v for n, v in mod.geo.stats() if n in ('hits', 'misses'))
+    start = time.perf_counter()
+    mod.update_stats()
+    d = time.perf_counter() - start
+
+    return d, sum(v for n, v in mod.geo.stats()
+                  if n in ('hits', 'misses')) - lookups
+
+
+def report(name, d, peers):
+    print('{:<8} {:>10.1f} {:>10} {:>12.0f}'.format(name, d * 1000, peers,
+                                                    peers / d))
+
+
+def top(snapshot, n):
+    stats = snapshot.filter_traces([tracemalloc.Filter(True, '*/pud/*')])
+    for s in stats.statistics('lineno')[:n]:
+        f = s.traceback[0]
+        print('  {:>10.1f} KiB {:>8} blocks  {}:{}'.format(
+            s.size / 1024, s.count, os.path.relpath(f.filename), f.lineno))
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Run PeerStats against a synthetic swarm.')
+    p.add_argument('--torrents', type=int, default=500,
+                   help='number of active torrents')
+    p.add_argument('--peers', type=int, default=100,
+                   help='number of peers per torrent')
+    p.add_argument('--uploading', type=float, default=1,
+                   help='part of peers which are uploaded to')
+    p.add_argument('--churn', type=float, default=0.1,
+                   help='part of peers replaced every tick')
+    p.add_argument('--ticks', type=int, default=10,
+                   help='number of measured ticks')
+    p.add_argument('--seed', type=int, default=0,
+                   help='random generator seed')
+    p.add_argument('--rollup', type=int, default=0,
+                   help='rollup window in seconds')
+    p.add_argument('--no-raw', action='store_true',
+                   help='do not write raw peer rows')
+    p.add_argument('--geolite', help='GeoLite2 City database to use '
+                   'instead of the generated one')
+    p.add_argument('--record', help='save generated responses to the file')
+    p.add_argument('--replay', help='serve responses from the file')
+    p.add_argument('--top', type=int, default=10,
+                   help='number of top allocation sites shown')
+    args = p.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # Spool is disabled, so nothing is written to disk.
+    daemon_cfg = pud.config.Config(None)
+    daemon_cfg['spool'] = False
+    pud.spool.configure(daemon_cfg)
+    pud.modules.peerstats.sink.Client = ClickHouse
+
+    geofile = args.geolite
+    if geofile is None:
+        fd, geofile = tempfile.mkstemp(suffix='.mmdb')
+        os.close(fd)
+        mmdb.write(geofile)
+    srv = Server(responses(args))
+    mod = PeerStats(threading.Event(), logging.getLogger('swarm'),
+                    config(srv.server_port, args, geofile))
+    try:
+        print('{:<8} {:>10} {:>10} {:>12}'.format('tick', 'ms', 'peers',
+                                                  'rows/s'))
+        # First tick fills GeoIP cache and dimensions, so it is reported
+        # separately.
+        d, peers = tick(mod)
+        report('cold', d, peers)
+        ds = []
+        total = 0
+        for i in range(args.ticks):
+            d, peers = tick(mod)
+            report(str(i + 1), d, peers)
+            ds.append(d)
+            total += peers
+        if ds:
+            print('median {:>10.1f} ms, max {:.1f} ms, {:.0f} rows/s'.format(
+                statistics.median(ds) * 1000, max(ds) * 1000,
+                total / sum(ds)))
+
+        tracemalloc.start(1)
+        tick(mod)
+        cur, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        print('tick allocations: peak {:.1f} MiB, retained {:.1f} MiB'.format(
+            peak / 1024 / 1024, cur / 1024 / 1024))
+        if args.top:
+            top(snapshot, args.top)
+    finally:
+        mod.close()
+        srv.close()
+        if args.geolite is None:
+            os.remove(geofile)
+
+    print('inserted: {}'.format(', '.join(
+        '{} {}'.format(t, n) for t, n in sorted(ClickHouse.rows.items()))))
+    print('geoip: {}'.format(', '.join(
+        '{} {}'.format(n, round(v, 3)) for n, v in mod.geo.stats())))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import pud
 
 
-pud.run()
+if __name__ == '__main__':
+    pud.run()
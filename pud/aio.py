@@ -0,0 +1,89 @@
+import inspect
+import logging
+import threading
+
+
+logger = logging.getLogger('pud')
+
+
+# threading.Event which can be awaited from coroutines too.
+# Modules get it as `term` so both blocking and async code can wait for
+# the daemon termination.
+class Event(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.waiters = set()
+        self.waitersmu = threading.Lock()
+
+    def set(self):
+        super().set()
+        with self.waitersmu:
+            waiters, self.waiters = self.waiters, set()
+        for loop, fut in waiters:
+            loop.call_soon_threadsafe(wake, fut)
+
+    async def asyncwait(self, timeout=None):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self.waitersmu:
+            if self.is_set():
+                return True
+            self.waiters.add((loop, fut))
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.waitersmu:
+                self.waiters.discard((loop, fut))
+
+        return self.is_set()
+
+
+def wake(fut):
+    if not fut.done():
+        fut.set_result(True)
+
+
+def iscoroutine(func):
+    return inspect.iscoroutinefunction(func)
+
+
+# Daemon-wide event loop running in a dedicated thread.
+# Has the same submit() interface as pud.pool.Pool but accepts
+# coroutine functions. asyncio is imported only once a loop or a coroutine
+# is used, so daemons without coroutine modules do not pay for it.
+class Loop:
+    def __init__(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True, name='asyncio')
+        self.thread.start()
+
+    def submit(self, func, *args):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(func(*args), self.loop)
+
+    def call(self, func, *args, timeout=None):
+        return self.submit(func, *args).result(timeout)
+
+    def close(self, timeout):
+        try:
+            self.call(self.drain, timeout)
+        except Exception:
+            logger.exception('Stopping event loop failed.')
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+    async def drain(self, timeout):
+        import asyncio
+        cur = asyncio.current_task()
+        tasks = [t for t in asyncio.all_tasks() if t is not cur]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for t in pending:
+            logger.warning('%s did not exited. Cancelling.', t.get_coro())
+            t.cancel()
@@ -1,3 +1,7 @@
+# Cron and long task methods can be defined either as regular functions or
+# as coroutines. Regular ones are executed in worker threads, coroutines
+# are executed on the daemon-wide event loop and must not block. Coroutines
+# can wait for termination with `await self.term.asyncwait(timeout)`.
 class Module:
     def __init__(self, term, logger, config):
         self.term = term
@@ -12,9 +16,18 @@ def task(func):
     return func
 
 
-def cron(expr):
+# concurrency limits how many runs of the cron may be active at once.
+# overrun tells what to do when the cron fires while the limit is reached:
+#   skip     -- drop the firing;
+#   queue    -- run every dropped firing once a slot is free;
+#   coalesce -- run only one extra time no matter how many firings were missed.
+# Both can be overridden with cron.concurrency and cron.overrun properties
+# in module's configuration file.
+def cron(expr, concurrency=None, overrun=None):
     def dec(func):
         func.pud_cron = expr
+        func.pud_concurrency = concurrency
+        func.pud_overrun = overrun
 
         return func
 
@@ -105,8 +105,25 @@ def parse(path):
     return config
 
 
-# TODO: Add configuration name based on conf-file to support
-#       multiple instances of the single module.
+def load_config(path):
+    if not os.path.exists(path):
+        return Config(path)
+
+    return parse(path)
+
+
+# Name of the module instance configured by config. Taken from `name`
+# property or the configuration file name, so a module can be run several
+# times with different configuration files.
+def name(config):
+    if 'name' in config:
+        return get(config, 'name', str)
+    if config.path is not None:
+        return os.path.splitext(os.path.basename(config.path))[0]
+
+    return config.get('module')
+
+
 def load_configs(path):
     configs = []
 
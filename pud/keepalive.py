@@ -0,0 +1,21 @@
+import http.client
+
+
+# Sends a request over keep-alive connection `conn` and returns the
+# connection with its response. Server may close an idle keep-alive
+# connection, so on failure the request is retried once with a fresh
+# connection returned by reconnect(). Failed connections are closed.
+def request(conn, reconnect, method, path, body=None, headers={}):
+    for retry in (True, False):
+        try:
+            conn.request(method, path, body=body, headers=headers)
+
+            return conn, conn.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            conn.close()
+            if not retry:
+                raise
+        except OSError:
+            conn.close()
+            raise
+        conn = reconnect()
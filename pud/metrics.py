@@ -0,0 +1,297 @@
+import time
+import struct
+import pickle
+import socket
+import logging
+import threading
+import pud.config
+import pud.spool
+
+
+PORT = 2003
+PICKLE_PORT = 2004
+INTERVAL = 60
+TIMEOUT = 10
+# Maximum number of datapoints in a single pickle message.
+PICKLE_BATCH = 500
+# Number of spooled flushes sent with a single write during replay.
+REPLAY_BATCH = 10
+
+logger = logging.getLogger('pud')
+
+defaults = pud.config.Config(None)
+endpoints = {}
+flushers = {}
+lock = threading.Lock()
+
+
+# Single persistent connection to a Graphite carbon receiver shared by all
+# senders using the same host, port and protocol. Data which could not be
+# sent is spooled to disk and replayed after the connection is restored.
+# Flushers of different intervals may send to the same endpoint at once,
+# so connecting, sending and spooling are serialized.
+class Endpoint:
+    def __init__(self, host, port, pickle):
+        self.host = host
+        self.port = port
+        self.pickle = pickle
+        self.sock = None
+        self.failed = False
+        self.lock = threading.Lock()
+        self.spool = pud.spool.spool('graphite-{}-{}'.format(host, port))
+
+    def __str__(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def send(self, points):
+        data = self.encode(points)
+        with self.lock:
+            try:
+                self.sendall(data)
+            except OSError:
+                self.spool.append([data])
+                return
+
+            try:
+                self.spool.replay(lambda ds: self.sendall(b''.join(ds)),
+                                  REPLAY_BATCH)
+            except OSError:
+                pass
+
+    def sendall(self, data):
+        try:
+            if self.sock is None:
+                self.sock = socket.create_connection((self.host, self.port),
+                                                     TIMEOUT)
+            self.sock.sendall(data)
+        except OSError as e:
+            self.disconnect()
+            if not self.failed:
+                logger.warning('Sending metrics to %s failed: %s', self, e)
+            self.failed = True
+            raise
+        if self.failed:
+            logger.info('Sending metrics to %s restored.', self)
+        self.failed = False
+
+    def encode(self, points):
+        if not self.pickle:
+            return ''.join('{} {} {}\n'.format(p, v, t)
+                           for p, t, v in points).encode('utf-8')
+
+        chunks = []
+        for i in range(0, len(points), PICKLE_BATCH):
+            payload = pickle.dumps([(p, (t, v))
+                                    for p, t, v in points[i:i + PICKLE_BATCH]],
+                                   protocol=2)
+            chunks.append(struct.pack('!L', len(payload)))
+            chunks.append(payload)
+
+        return b''.join(chunks)
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def take(self):
+        with self.lock:
+            v, self.value = self.value, 0
+
+        return v
+
+
+# Module's view of the pipeline. Keeps registered gauges and counters under
+# the module's prefix. Re-registering a metric with the same name replaces
+# the previous one. Hooks are called once per flush before metrics are
+# collected, e.g. to take a snapshot all gauges read from.
+class Sender:
+    def __init__(self, endpoint, prefix, interval):
+        self.endpoint = endpoint
+        self.prefix = prefix
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.hooks = []
+
+    def path(self, name):
+        return '.'.join(x for x in (self.prefix, name) if x)
+
+    def gauge(self, name, func):
+        with self.lock:
+            self.metrics[name] = ('gauge', func)
+
+    def gauges(self, name, func):
+        with self.lock:
+            self.metrics[name] = ('gauges', func)
+
+    def counter(self, name):
+        with self.lock:
+            kind, c = self.metrics.get(name, (None, None))
+            if kind != 'counter':
+                c = Counter()
+                self.metrics[name] = ('counter', c)
+
+        return c
+
+    def remove(self, name):
+        with self.lock:
+            self.metrics.pop(name, None)
+
+    def hook(self, func):
+        with self.lock:
+            self.hooks.append(func)
+
+    def close(self):
+        with lock:
+            flusher = flushers.get(self.interval)
+        if flusher is not None:
+            flusher.remove(self)
+
+    def collect(self, ts, points):
+        with self.lock:
+            hooks = list(self.hooks)
+            metrics = list(self.metrics.items())
+
+        for h in hooks:
+            try:
+                h()
+            except Exception:
+                logger.exception('Metrics hook of %s failed.', self.prefix)
+                return
+
+        for name, (kind, m) in metrics:
+            try:
+                if kind == 'counter':
+                    points.append((self.path(name), ts, m.take()))
+                elif kind == 'gauge':
+                    v = m()
+                    if v is not None:
+                        points.append((self.path(name), ts, v))
+                else:
+                    for n, v in m() or ():
+                        if v is not None:
+                            points.append((self.path(name + '.' + n), ts, v))
+            except Exception:
+                logger.exception('Collecting %s metric failed.',
+                                 self.path(name))
+
+
+# Collects all senders with the same interval once per interval and writes
+# their datapoints with a single write per endpoint.
+class Flusher(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True, name='metrics-{}'.format(interval))
+        self.interval = interval
+        self.senders = []
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def add(self, sender):
+        with self.lock:
+            self.senders.append(sender)
+
+    def remove(self, sender):
+        with self.lock:
+            if sender in self.senders:
+                self.senders.remove(sender)
+
+    def run(self):
+        while True:
+            now = time.time()
+            if self.stopping.wait((now // self.interval + 1) * self.interval
+                                  - now):
+                break
+            self.flush()
+
+    def flush(self):
+        ts = int(time.time())
+        with self.lock:
+            senders = list(self.senders)
+
+        batches = {}
+        for s in senders:
+            s.collect(ts, batches.setdefault(s.endpoint, []))
+        for e, points in batches.items():
+            if points:
+                e.send(points)
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+        self.flush()
+
+
+# Sets daemon-wide Graphite properties used when a module configuration
+# does not define them.
+def configure(daemon_cfg):
+    global defaults
+    defaults = daemon_cfg
+
+
+def option(config, name, prop_type, default=None):
+    return pud.config.get(config, name, prop_type,
+                          pud.config.get(defaults, name, prop_type, default))
+
+
+def graphite(config):
+    host = option(config, 'graphite.host', str)
+    if host is None:
+        raise pud.config.MissingError('graphite.host')
+    prefix = pud.config.get(config, 'graphite.prefix', str)
+    if prefix is None:
+        # Daemon-wide prefix is shared by all modules, so it is followed by
+        # the instance name to keep metrics of instances apart.
+        prefix = pud.config.get(defaults, 'graphite.prefix', str)
+        if prefix is None:
+            raise pud.config.MissingError('graphite.prefix')
+        prefix = '.'.join(x for x in (prefix, pud.config.name(config)) if x)
+    usepickle = option(config, 'graphite.pickle', bool, False)
+    port = option(config, 'graphite.port', int,
+                  PICKLE_PORT if usepickle else PORT)
+    interval = option(config, 'graphite.interval', int, INTERVAL)
+    if interval < 1:
+        raise pud.config.ConfigurationError(
+            'Property `graphite.interval` must be positive.')
+
+    return sender(host, port, prefix, interval, usepickle)
+
+
+def sender(host, port, prefix, interval=INTERVAL, usepickle=False):
+    with lock:
+        key = (host, port, usepickle)
+        if key not in endpoints:
+            endpoints[key] = Endpoint(host, port, usepickle)
+        if interval not in flushers:
+            flushers[interval] = Flusher(interval)
+            flushers[interval].start()
+        s = Sender(endpoints[key], prefix, interval)
+        flushers[interval].add(s)
+
+    return s
+
+
+def close():
+    with lock:
+        fs = list(flushers.values())
+        flushers.clear()
+        es = list(endpoints.values())
+        endpoints.clear()
+    for f in fs:
+        f.stop()
+    for e in es:
+        e.close()
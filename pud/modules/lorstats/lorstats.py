@@ -1,11 +1,18 @@
 import re
-import time
+import queue
+import codecs
 import datetime
 import threading
 import http.client
-import sqlite3
-import pyrite
+import concurrent.futures
 import pud
+import pud.metrics
+import pud.storage
+import pud.keepalive
+
+
+SCORE_RE = re.compile(r'<b>Score:</b> (\d+)<br>')
+COMMENTS_RE = re.compile(r'<b>Число комментариев:</b> (\d+)<p>')
 
 
 class Stats:
@@ -31,80 +38,182 @@ class Stats:
             self.cmnts = cmnts
 
 
+# Pool of keep-alive HTTPS connections to a single host.
+class Connections:
+    def __init__(self, host, size, timeout):
+        self.host = host
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.new()
+
+    def new(self):
+        return http.client.HTTPSConnection(self.host, 443,
+                                           timeout=self.timeout)
+
+    def put(self, conn):
+        if self.idle.qsize() < self.size:
+            self.idle.put(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
 class LorStats(pud.Module):
     UA = 'Mozilla/5.0 (X11; Linux x86_64; rv:88.0) Gecko/20100101 Firefox/88.0'
+    HOST = 'www.linux.org.ru'
+    CHUNK = 16 * 1024
+    # Number of characters kept from the previous chunk to match values
+    # split between chunks.
+    OVERLAP = 128
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.cookie = pud.config.get_required(self.config, 'cookie', str)
-        self.dbpath = pud.config.get_required(self.config, 'db', str)
+        self.db = pud.storage.open(
+            pud.config.get_required(self.config, 'db', str))
+        profiles = pud.config.get(self.config, 'profiles', str, 'urxvt')
+        self.profiles = [p.strip() for p in profiles.split(',') if p.strip()]
+        if not self.profiles:
+            raise pud.config.ConfigurationError(
+                'Property `profiles` must not be empty.')
+        size = pud.config.get(self.config, 'http.connections', int, 4)
+        timeout = pud.config.get(self.config, 'http.timeout', int, 30)
+        if size < 1 or timeout < 1:
+            raise pud.config.ConfigurationError(
+                'Properties `http.connections` and `http.timeout` '
+                'must be positive.')
+        self.conns = Connections(self.HOST, size, timeout)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(size, len(self.profiles)),
+            thread_name_prefix='lorstats')
+
+        self.graphite = pud.metrics.graphite(self.config)
+
+        self.st = {p: Stats() for p in self.profiles}
+        # Single profile setup keeps writing the original stats table.
+        if len(self.profiles) == 1:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS stats (
+                time INT PRIMARY KEY,
+                score INT,
+                comments INT
+            )
+            ''')
+        else:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS profile_stats (
+                time INT,
+                profile TEXT,
+                score INT,
+                comments INT,
+                PRIMARY KEY (time, profile)
+            )
+            ''')
 
-        ghost = pud.config.get_required(self.config, 'graphite.host', str)
-        gprefix = pud.config.get_required(self.config, 'graphite.prefix', str)
-        self.graphite = pyrite.Pyrite(ghost, 2003, prefix=gprefix)
-
-        self.st = Stats()
-        self.dbexec('''
-            CREATE TABLE IF NOT EXISTS stats (
-            time INT PRIMARY KEY,
-            score INT,
-            comments INT
-        )
-        ''')
+    def close(self):
+        self.graphite.close()
+        self.executor.shutdown()
+        self.conns.close()
 
+    # Initial fetch is done in background, so it does not delay startup.
+    @pud.task
+    def init_stats(self):
         try:
             self.stats()
-        except e:
+        except Exception as e:
             self.logger.error('failed to get stats: %s', e)
 
-    def close(self):
-        self.graphite.close()
-
     @pud.cron('0 * * * *')
     def stats(self):
-        p = self.getprofile()
-        self.st.setscore(self.getscore(p))
-        self.st.setcomments(self.getcomments(p))
-
-        sql = ('INSERT INTO stats (time, score, comments) '
-               'VALUES (?, ?, ?)')
-        self.dbexec(sql, (int(datetime.datetime.utcnow().timestamp()),
-                          self.st.getscore(),
-                          self.st.getcomments()))
-
-        self.graphite.gauge('score', self.st.getscore)
-        self.graphite.gauge('comments', self.st.getcomments)
-        self.graphite.counter('update').inc()
-
-    def dbexec(self, sql, params=()):
-        conn = sqlite3.connect(self.dbpath)
+        now = int(datetime.datetime.utcnow().timestamp())
+        futures = {self.executor.submit(self.getstats, p): p
+                   for p in self.profiles}
+        failed = 0
+        for f in concurrent.futures.as_completed(futures):
+            p = futures[f]
+            try:
+                score, cmnts = f.result()
+            except Exception as e:
+                self.logger.error('failed to get %s stats: %s', p, e)
+                failed += 1
+                continue
+
+            st = self.st[p]
+            st.setscore(score)
+            st.setcomments(cmnts)
+            if len(self.profiles) == 1:
+                self.db.execute('INSERT INTO stats (time, score, comments) '
+                                'VALUES (?, ?, ?)', (now, score, cmnts))
+            else:
+                self.db.execute('INSERT INTO profile_stats '
+                                '(time, profile, score, comments) '
+                                'VALUES (?, ?, ?, ?)',
+                                (now, p, score, cmnts))
+
+            # Keep metric names of a single profile setup.
+            prefix = '' if len(self.profiles) == 1 else p + '.'
+            self.graphite.gauge(prefix + 'score', st.getscore)
+            self.graphite.gauge(prefix + 'comments', st.getcomments)
+            self.graphite.counter(prefix + 'update').inc()
+
+        if failed:
+            raise IOError('failed to get stats of {} profiles'.format(failed))
+
+    def getstats(self, profile):
+        path = '/people/{}/profile'.format(profile)
+        headers = {'User-Agent': self.UA, 'Cookie': self.cookie}
+        conn, resp = pud.keepalive.request(self.conns.get(), self.conns.new,
+                                           'GET', path, headers=headers)
         try:
-            with conn:
-                conn.execute(sql, params)
-        finally:
+            if resp.status != 200:
+                raise IOError('non-OK server response: {}'.format(resp.status))
+            score, cmnts = self.parse(resp)
+            # Read the rest of the page without parsing it, so the
+            # connection can be reused.
+            while resp.read(self.CHUNK):
+                pass
+        except Exception:
             conn.close()
-
-    def getprofile(self):
-        conn = http.client.HTTPSConnection('www.linux.org.ru', 443)
-        conn.request('GET', '/people/urxvt/profile',
-                     headers={'User-Agent': self.UA, 'Cookie': self.cookie})
-
-        resp = conn.getresponse()
-        if resp.status != 200:
-            raise IOError('non-OK server response: {}'.format(resp.status))
-
-        return resp.read().decode('utf-8')
-
-    def getscore(self, profile):
-        m = re.search('<b>Score:</b> (\d+)<br>', profile)
-        if not m:
+            raise
+        self.conns.put(conn)
+
+        return score, cmnts
+
+    # Reads profile page till both values are found.
+    def parse(self, resp):
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        text = ''
+        score = cmnts = None
+        while score is None or cmnts is None:
+            chunk = resp.read(self.CHUNK)
+            if not chunk:
+                break
+            text = text[-self.OVERLAP:] + decoder.decode(chunk)
+            if score is None:
+                score = self.search(SCORE_RE, text)
+            if cmnts is None:
+                cmnts = self.search(COMMENTS_RE, text)
+
+        if score is None:
             raise IOError('score not found')
+        if cmnts is None:
+            raise IOError('comments not found')
 
-        return int(m.group(1))
+        return score, cmnts
 
-    def getcomments(self, profile):
-        m = re.search('<b>Число комментариев:</b> (\d+)<p>', profile)
-        if not m:
-            raise IOError('comments not found')
+    def search(self, regexp, text):
+        m = regexp.search(text)
 
-        return int(m.group(1))
+        return int(m.group(1)) if m else None
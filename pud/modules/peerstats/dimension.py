@@ -0,0 +1,50 @@
+import threading
+
+
+# In-memory copy of a dimension table mapping keys to ids. New keys get
+# sequential ids immediately and their rows are kept until take() to be
+# inserted with a single query. Can be shared by several threads.
+class Dimension:
+    BLOCK_SIZE = 65536
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.query = 'INSERT INTO {} (id, {}) VALUES'.format(
+            table, ', '.join(columns))
+        self.ids = {}
+        self.last = 0
+        self.new = []
+        self.lock = threading.Lock()
+
+    # Streams existing (id, key) pairs from ClickHouse block by block
+    # instead of fetching the whole table at once.
+    def load(self, client):
+        q = 'SELECT id, {} FROM {}'.format(self.columns[0], self.table)
+        rows = client.execute_iter(q, settings={
+            'max_block_size': self.BLOCK_SIZE})
+        for id, key in rows:
+            self.ids[key] = id
+            if id > self.last:
+                self.last = id
+
+    def get(self, key, *values):
+        id = self.ids.get(key)
+        if id is not None:
+            return id
+
+        with self.lock:
+            id = self.ids.get(key)
+            if id is None:
+                self.last += 1
+                id = self.last
+                self.ids[key] = id
+                self.new.append((id, key) + values)
+
+        return id
+
+    def take(self):
+        with self.lock:
+            rows, self.new = self.new, []
+
+        return rows
@@ -0,0 +1,67 @@
+import time
+import threading
+import collections
+import maxminddb
+
+
+Geo = collections.namedtuple('Geo', ['country', 'lat', 'lon'])
+
+NOTFOUND = Geo('', 0, 0)
+
+
+# LRU cache of GeoLite2 City lookups with expiration. Reads the MMDB
+# database with maxminddb directly, so only country code and location are
+# taken from the raw record instead of building a full geoip2 City model.
+# Addresses missing in the database are cached too.
+class GeoCache:
+    def __init__(self, path, size=65536, ttl=3600):
+        # MODE_AUTO memory-maps the file with the C extension if it is
+        # available. Other modes fall back to the much slower pure Python
+        # reader.
+        self.db = maxminddb.open_database(path, maxminddb.MODE_AUTO)
+        self.size = size
+        self.ttl = ttl
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ip):
+        now = time.monotonic()
+        with self.lock:
+            e = self.cache.get(ip)
+            if e is not None and e[1] > now:
+                self.cache.move_to_end(ip)
+                self.hits += 1
+                return e[0]
+            self.misses += 1
+
+        geo = self.lookup(ip)
+        with self.lock:
+            self.cache[ip] = (geo, now + self.ttl)
+            self.cache.move_to_end(ip)
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+        return geo
+
+    def lookup(self, ip):
+        r = self.db.get(ip)
+        if r is None:
+            return NOTFOUND
+        loc = r.get('location', {})
+
+        return Geo(r.get('country', {}).get('iso_code', ''),
+                   loc.get('latitude', 0),
+                   loc.get('longitude', 0))
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return [('hits', self.hits),
+                    ('misses', self.misses),
+                    ('size', len(self.cache)),
+                    ('hit_rate', self.hits / total if total else 0)]
+
+    def close(self):
+        self.db.close()
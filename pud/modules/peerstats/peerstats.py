@@ -26,158 +26,142 @@
 # )
 # ENGINE = MergeTree()
 # ORDER BY (time);
+#
+# Used if rollup.window is set. speed is the sum of all peer speed samples
+# in the window, samples is the number of samples and ips is the number of
+# distinct peer addresses. A window interrupted by a restart is inserted
+# in two parts with the same time, so readers have to aggregate rows by
+# time, e.g. sum(speed) / sum(samples). ips of such a window is the sum
+# of both parts, so an address seen in both is counted twice and ips is
+# approximate.
+# CREATE TABLE peers_rollup (
+#     time DateTime('UTC'),
+#     torrent UInt32,
+#     client UInt32,
+#     country FixedString(2),
+#     speed UInt64,
+#     samples UInt32,
+#     ips UInt32
+# )
+# ENGINE = MergeTree()
+# ORDER BY (time);
 
 import time
-import json
-import collections
-import http.client
-from clickhouse_driver import Client
-import geoip2.database
 import pud
+import pud.metrics
+import pud.sources
+from pud.modules.transmission import rpc
+from .geo import GeoCache
+from . import sink
+from .rollup import Rollup
 
 
-Torrent = collections.namedtuple('Torrent', ['hash', 'name', 'comment', 'peers'])
-Peer = collections.namedtuple('Peer', ['ip', 'client', 'speed'])
-Geo = collections.namedtuple('Geo', ['country', 'lat', 'lon'])
-
-
-class Transmission:
-    SID_HEADER = 'X-Transmission-Session-Id'
-
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.sid = ''
-
-    def get_torrents(self):
-        resp = self.request('torrent-get',
-                            {'ids': 'recently-active',
-                             'fields': ['id', 'name', 'comment',
-                                        'hashString', 'peers']})
-        torrents = []
-        for tr in resp['torrents']:
-            peers = []
-            for p in tr['peers']:
-                if p['isUploadingTo']:
-                    peers.append(Peer(ip=p['address'],
-                                      client=p['clientName'],
-                                      speed=p['rateToPeer']))
-            if peers:
-                torrents.append(Torrent(hash=tr['hashString'],
-                                        name=tr['name'],
-                                        comment=tr['comment'],
-                                        peers=peers))
-
-        return torrents
-
-    def request(self, method, args):
-        body = {'method': method,
-                'arguments': args}
-        retry = 2
-        while retry:
-            conn = http.client.HTTPConnection(self.host, self.port)
-            conn.request('POST', '/rpc', body=json.dumps(body),
-                         headers={self.SID_HEADER: self.sid,
-                                  'Content-Type': 'application/json'})
-            resp = conn.getresponse()
-            if resp.status == 200:
-                return json.loads(resp.read().decode('utf-8'))['arguments']
-            elif resp.status == 409:
-                self.sid = resp.getheader(self.SID_HEADER)
-                retry -= 1
-            else:
-                raise IOError('non-OK server response: {}'.format(resp.status))
+PEERS_COLUMNS = ['time', 'torrent', 'ip', 'client', 'speed',
+                 'country', 'lat', 'lon']
+ROLLUP_COLUMNS = ['time', 'torrent', 'client', 'country',
+                  'speed', 'samples', 'ips']
+# Default RPC URL PeerStats has always used.
+PATH = '/rpc'
 
 
+# Instances polling the same transmission-daemon, writing to the same
+# ClickHouse database or using the same GeoLite database share them.
 class PeerStats(pud.Module):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        trhost = pud.config.get_required(self.config, 'transmission.host', str)
-        trport = pud.config.get_required(self.config, 'transmission.port', int)
-        self.tr = Transmission(trhost, trport)
-
-        chhost = pud.config.get_required(self.config, 'clickhouse.host', str)
-        chport = pud.config.get_required(self.config, 'clickhouse.port', int)
-        chdb = pud.config.get_required(self.config, 'clickhouse.db', str)
-        self.ch = Client(chhost, chport, chdb)
+        self.tr = rpc.source(self.config, PATH)
+        self.ttl = rpc.ttl(self.config)
+
+        chhost, chport, chdb = database(self.config)
+        batch = pud.config.get(self.config, 'clickhouse.batch', int, 100000)
+        age = pud.config.get(self.config, 'clickhouse.flush', int, 60)
+        raw = pud.config.get(self.config, 'rollup.raw', bool, True)
+        window = pud.config.get(self.config, 'rollup.window', int, 0)
+        if not raw and window <= 0:
+            raise pud.config.ConfigurationError(
+                'Property `rollup.window` must be set '
+                'if `rollup.raw` is false.')
+        self.sink = sink.sink(chhost, chport, chdb, self.logger, batch, age)
+        self.ch = self.sink.conn
+        self.clients = self.ch.clients
+        self.torrents = self.ch.torrents
+
+        self.writer = None
+        if raw:
+            self.writer = self.ch.writer('peers', PEERS_COLUMNS)
+        self.rollup = None
+        if window > 0:
+            self.rollup = Rollup(window)
+            self.rollup_writer = self.ch.writer('peers_rollup',
+                                                ROLLUP_COLUMNS)
 
         geofile = pud.config.get_required(self.config, 'geolite.file', str)
-        self.geodb = geoip2.database.Reader(geofile)
-
-        self.clients = self.get_clients()
-        self.torrents = self.get_torrents()
+        self.geosrc = pud.sources.acquire(
+            'geolite-' + geofile,
+            lambda: GeoCache(
+                geofile,
+                size=pud.config.get(self.config, 'geolite.cache', int, 65536),
+                ttl=pud.config.get(self.config, 'geolite.ttl', int, 3600)))
+        self.geo = self.geosrc.conn
+
+        self.graphite = None
+        if pud.metrics.option(self.config, 'graphite.host', str):
+            self.graphite = pud.metrics.graphite(self.config)
+            self.graphite.gauges('geoip', self.geo.stats)
+            self.graphite.gauges('rpc', self.tr.stats)
+
+    # Dimension ids of a database are assigned by the sink shared by all
+    # instances writing to it, so such instances must run in one process.
+    @staticmethod
+    def owned(config):
+        return [sink.name(*database(config))]
 
     def close(self):
-        self.ch.disconnect_connection()
-        self.geodb.close()
+        if self.graphite is not None:
+            self.graphite.close()
+        pud.sources.release(self.tr)
+        if self.rollup is not None:
+            # Partial window is inserted too, so it is not lost on restart.
+            # The rest of the window is inserted as a separate row with the
+            # same time (see peers_rollup above).
+            for r in self.rollup.take():
+                self.rollup_writer.append(r)
+            self.rollup_writer.flush()
+        pud.sources.release(self.sink)
+        pud.sources.release(self.geosrc)
 
     @pud.cron('* * * * * */10')
     def update_stats(self):
         now = int(time.time())
-        peers = []
-        for t in self.tr.get_torrents():
+        if self.rollup is not None:
+            # Finished window is queued before polling, so it is not lost
+            # if the poll fails.
+            for r in self.rollup.roll(now):
+                self.rollup_writer.append(r)
+            self.rollup_writer.tick()
+        torrents = self.tr.query('torrents', rpc.Transmission.get_torrents,
+                                 self.ttl)
+        for t in torrents:
+            tid = self.torrents.get(t.hash, t.name, t.comment)
             for p in t.peers:
-                geo = self.geoinfo(p.ip)
-                peers.append({'time': now,
-                              'torrent': self.get_torrent_id(t),
-                              'ip': p.ip,
-                              'client': self.get_client_id(p.client),
-                              'speed': p.speed,
-                              'country': geo.country,
-                              'lat': geo.lat,
-                              'lon': geo.lon})
-
-        q = '''
-        INSERT INTO peers (
-            time, torrent, ip, client, speed, country, lat, lon
-        ) VALUES
-        '''
-        self.ch.execute(q, peers)
-
-    def get_torrent_id(self, torrent):
-        if torrent.hash not in self.torrents:
-            id = max(list(self.torrents.values()) + [0]) + 1
-            q = 'INSERT INTO torrents (id, hash, name, comment) VALUES'
-            self.ch.execute(q, [{'id': id,
-                                 'hash': torrent.hash,
-                                 'name': torrent.name,
-                                 'comment': torrent.comment}])
-            self.torrents[torrent.hash] = id
-
-        return self.torrents[torrent.hash]
-
-    def get_client_id(self, client):
-        if client not in self.clients:
-            id = max(list(self.clients.values()) + [0]) + 1
-            q = 'INSERT INTO clients (id, name) VALUES'
-            self.ch.execute(q, [{'id': id,
-                                 'name': client}])
-            self.clients[client] = id
-
-        return self.clients[client]
-
-    def get_clients(self):
-        rows = self.ch.execute('SELECT id, name FROM clients')
-        cls = {}
-        for r in rows:
-            cls[r[1]] = r[0]
-
-        return cls
-
-    def get_torrents(self):
-        rows = self.ch.execute('SELECT id, hash FROM torrents')
-        trs = {}
-        for r in rows:
-            trs[r[1]] = r[0]
-
-        return trs
-
-    def geoinfo(self, ip):
-        try:
-            g = self.geodb.city(ip)
-
-            return Geo(g.country.iso_code,
-                       g.location.latitude,
-                       g.location.longitude)
-        except geoip2.errors.AddressNotFoundError:
-            return Geo('', 0, 0)
+                geo = self.geo.get(p.ip)
+                cid = self.clients.get(p.client)
+                if self.writer is not None:
+                    self.writer.append((now, tid, p.ip, cid, p.speed,
+                                        geo.country, geo.lat, geo.lon))
+                if self.rollup is not None:
+                    self.rollup.add(tid, cid, geo.country, p.ip, p.speed)
+
+        if self.writer is not None:
+            self.writer.tick()
+
+    @pud.cron('0 * * * *')
+    def log_stats(self):
+        self.logger.info('GeoIP cache: %s.', ', '.join(
+            '{} {}'.format(n, v) for n, v in self.geo.stats()))
+
+
+def database(config):
+    return (pud.config.get_required(config, 'clickhouse.host', str),
+            pud.config.get_required(config, 'clickhouse.port', int),
+            pud.config.get_required(config, 'clickhouse.db', str))
@@ -0,0 +1,34 @@
+# Aggregates peer samples per (torrent, client, country) over fixed time
+# windows aligned to `window` seconds.
+class Rollup:
+    def __init__(self, window):
+        self.window = window
+        self.start = None
+        self.groups = {}
+
+    # Starts window containing `now`. Returns rows of the previous window
+    # if it is over.
+    def roll(self, now):
+        start = now - now % self.window
+        rows = []
+        if self.start is not None and start != self.start:
+            rows = self.take()
+        self.start = start
+
+        return rows
+
+    def add(self, torrent, client, country, ip, speed):
+        k = (torrent, client, country)
+        g = self.groups.get(k)
+        if g is None:
+            g = self.groups[k] = [0, 0, set()]
+        g[0] += speed
+        g[1] += 1
+        g[2].add(ip)
+
+    def take(self):
+        rows = [(self.start, t, cl, co, speed, samples, len(ips))
+                for (t, cl, co), (speed, samples, ips) in self.groups.items()]
+        self.groups = {}
+
+        return rows
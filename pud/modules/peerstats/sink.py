@@ -0,0 +1,93 @@
+import threading
+from clickhouse_driver import Client
+import pud.spool
+import pud.sources
+from .writer import Writer, ERRORS, rejected, replay
+from .dimension import Dimension
+
+
+# ClickHouse database shared by all PeerStats instances writing to it.
+# Dimension ids have to be assigned by a single owner per database, and
+# rows of all instances are inserted by the same writers, so a single
+# process can feed many instances into one database with one connection
+# and one insert thread per table. Instances sharing a database therefore
+# can not run in separate processes (see PeerStats.owned()).
+class Sink:
+    def __init__(self, host, port, db, logger, rows, age):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.logger = logger
+        self.rows = rows
+        self.age = age
+        self.spool = pud.spool.spool(name(host, port, db))
+        self.lock = threading.Lock()
+        self.writers = {}
+        self.client = Client(host, port, db)
+        # Spooled dimension rows hold ids which are not in ClickHouse yet,
+        # so the spool is replayed before ids are loaded. Otherwise new
+        # keys would get the same ids.
+        self.spool.replay(lambda rs: replay(self.client, rs, logger),
+                          limit=float('inf'))
+        self.clients = Dimension('clients', ['name'])
+        self.clients.load(self.client)
+        self.torrents = Dimension('torrents', ['hash', 'name', 'comment'])
+        self.torrents.load(self.client)
+
+    def writer(self, table, columns):
+        with self.lock:
+            if table not in self.writers:
+                self.writers[table] = Writer(
+                    Client(self.host, self.port, self.db), table, columns,
+                    self.logger, self.spool, rows=self.rows, age=self.age,
+                    before=self.flush)
+
+            return self.writers[table]
+
+    # Inserts new dimension rows. Called by writer threads before every
+    # batch, so ids of the batch are inserted ahead of it and the caller
+    # thread never waits for ClickHouse. If ClickHouse is not available rows
+    # are spooled to disk and inserted later, after a successful insert.
+    def flush(self):
+        with self.lock:
+            for d in (self.torrents, self.clients):
+                rows = d.take()
+                if rows:
+                    self.insert(d.query, rows)
+
+    def insert(self, q, rows):
+        try:
+            self.client.execute(q, rows)
+        except ERRORS as e:
+            if rejected(e):
+                self.logger.error('Inserting %d rows failed. Dropping: %s',
+                                  len(rows), e)
+                return
+            self.logger.error('Inserting %d rows failed. Spooling: %s',
+                              len(rows), e)
+            self.spool.append([(q, rows, False)])
+            return
+
+        try:
+            self.spool.replay(lambda rs: replay(self.client, rs,
+                                                self.logger))
+        except ERRORS as e:
+            self.logger.error('Replaying spooled rows failed: %s', e)
+
+    def close(self):
+        for w in self.writers.values():
+            w.close()
+        self.flush()
+        self.client.disconnect_connection()
+
+
+def name(host, port, db):
+    return 'clickhouse-{}-{}-{}'.format(host, port, db)
+
+
+# Returns shared sink of the database. Batch limits of the instance which
+# opened the sink first are used.
+def sink(host, port, db, logger, rows, age):
+    return pud.sources.acquire(name(host, port, db),
+                               lambda: Sink(host, port, db, logger, rows,
+                                            age))
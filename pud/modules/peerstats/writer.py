@@ -0,0 +1,146 @@
+import time
+import queue
+import threading
+import clickhouse_driver.errors
+
+
+# Errors of a failed insert. Rows are spooled and inserted later unless
+# the error is a rejection, see rejected().
+ERRORS = (clickhouse_driver.errors.Error, OSError, EOFError, ValueError,
+          TypeError)
+# Server errors of rows which will never be accepted, like a missing table
+# or a value not matching its column type. Other server errors, like too
+# many parts or memory limit exceeded, are temporary.
+REJECTED_CODES = {
+    getattr(clickhouse_driver.errors.ErrorCodes, c) for c in (
+        'UNKNOWN_TABLE', 'UNKNOWN_DATABASE', 'NO_SUCH_COLUMN_IN_TABLE',
+        'THERE_IS_NO_COLUMN', 'NOT_FOUND_COLUMN_IN_BLOCK',
+        'INCORRECT_NUMBER_OF_COLUMNS', 'NUMBER_OF_COLUMNS_DOESNT_MATCH',
+        'DUPLICATE_COLUMN', 'ILLEGAL_COLUMN', 'TYPE_MISMATCH',
+        'UNKNOWN_TYPE', 'CANNOT_CONVERT_TYPE', 'ILLEGAL_TYPE_OF_ARGUMENT',
+        'CANNOT_PARSE_TEXT', 'CANNOT_PARSE_NUMBER', 'CANNOT_PARSE_DATE',
+        'CANNOT_PARSE_DATETIME', 'CANNOT_PARSE_INPUT_ASSERTION_FAILED',
+        'INCORRECT_DATA', 'TOO_LARGE_STRING_SIZE',
+        'CANNOT_INSERT_NULL_IN_ORDINARY_COLUMN',
+        'VALUE_IS_OUT_OF_RANGE_OF_DATA_TYPE', 'SYNTAX_ERROR',
+        'UNKNOWN_IDENTIFIER')}
+# Client side errors of values which can not be encoded for their columns.
+REJECTED = (clickhouse_driver.errors.CannotParseDomainError,
+            clickhouse_driver.errors.CannotParseUuidError,
+            clickhouse_driver.errors.TypeMismatchError,
+            clickhouse_driver.errors.TooLargeStringSize,
+            clickhouse_driver.errors.UnknownTypeError,
+            ValueError, TypeError)
+
+
+# Returns True if rows failed with error e will never be accepted, so they
+# have to be dropped instead of being spooled. Otherwise a single such
+# batch would block replay of the whole spool.
+def rejected(e):
+    if isinstance(e, clickhouse_driver.errors.ServerException):
+        return e.code in REJECTED_CODES
+
+    return isinstance(e, REJECTED)
+
+
+# Buffers rows of a single table in column arrays and inserts them with
+# clickhouse_driver's columnar mode once `rows` rows are collected or the
+# oldest buffered row is older than `age` seconds. Inserts are done by a
+# separate thread with its own connection, so a slow insert does not delay
+# the caller. Failed inserts are spooled and replayed later. before() is
+# called by the insert thread ahead of every batch.
+class Writer:
+    def __init__(self, client, table, columns, logger, spool,
+                 rows=100000, age=60, before=None):
+        self.client = client
+        self.before = before
+        self.query = 'INSERT INTO {} ({}) VALUES'.format(table,
+                                                         ', '.join(columns))
+        self.ncols = len(columns)
+        self.logger = logger
+        self.spool = spool
+        self.rows = rows
+        self.age = age
+        self.lock = threading.Lock()
+        self.reset()
+        self.batches = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='writer-' + table)
+        self.thread.start()
+
+    def reset(self):
+        self.buf = [[] for _ in range(self.ncols)]
+        self.first = None
+
+    def append(self, row):
+        with self.lock:
+            if self.first is None:
+                self.first = time.monotonic()
+            for col, v in zip(self.buf, row):
+                col.append(v)
+
+    # Schedules an insert if any of the limits is reached.
+    def tick(self):
+        with self.lock:
+            if self.first is None:
+                return
+            if (len(self.buf[0]) < self.rows
+                    and time.monotonic() - self.first < self.age):
+                return
+            buf = self.buf
+            self.reset()
+        self.batches.put(buf)
+
+    def flush(self):
+        with self.lock:
+            buf = self.buf
+            self.reset()
+        if buf[0]:
+            self.batches.put(buf)
+
+    def run(self):
+        while True:
+            buf = self.batches.get()
+            if buf is None:
+                break
+            if self.before is not None:
+                self.before()
+            self.insert(buf)
+
+    def insert(self, columns):
+        try:
+            self.client.execute(self.query, columns, columnar=True)
+        except ERRORS as e:
+            if rejected(e):
+                self.logger.error('Inserting %d rows failed. Dropping: %s',
+                                  len(columns[0]), e)
+                return
+            self.logger.error('Inserting %d rows failed. Spooling: %s',
+                              len(columns[0]), e)
+            self.spool.append([(self.query, columns, True)])
+            return
+
+        try:
+            self.spool.replay(lambda rs: replay(self.client, rs,
+                                                self.logger))
+        except ERRORS as e:
+            self.logger.error('Replaying spooled rows failed: %s', e)
+
+    def close(self):
+        self.flush()
+        self.batches.put(None)
+        self.thread.join()
+        self.client.disconnect_connection()
+
+
+# Executes spooled (query, data, columnar) records. Rejected records are
+# dropped.
+def replay(client, records, logger):
+    for q, data, columnar in records:
+        try:
+            client.execute(q, data, columnar=columnar)
+        except ERRORS as e:
+            if not rejected(e):
+                raise
+            logger.error('Inserting %d spooled rows failed. Dropping: %s',
+                         len(data[0]) if columnar else len(data), e)
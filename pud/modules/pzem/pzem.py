@@ -1,17 +1,15 @@
 import pzem
-import pyrite
 import pud
+import pud.metrics
 
 
 class Pzem(pud.Module):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.dev = pud.config.get_required(self.config, 'dev', str)
-        ghost = pud.config.get_required(self.config, 'graphite.host', str)
-        gprefix = pud.config.get_required(self.config, 'graphite.prefix', str)
 
-        graphite = pyrite.Pyrite(ghost, 2003, prefix=gprefix, interval=60)
-        graphite.gauges('stats', self.stats)
+        self.graphite = pud.metrics.graphite(self.config)
+        self.graphite.gauges('stats', self.stats)
 
     def close(self):
         self.graphite.close()
@@ -0,0 +1,80 @@
+import time
+import select
+import socket
+from .snapshot import ProcFile
+
+
+RTMGRP_LINK = 1
+# Interval of link rescans when netlink socket is not available.
+RESCAN = 300
+
+MOUNTS = 'mounts'
+LINKS = 'links'
+
+
+def unescape(s):
+    return (s.replace('\\040', ' ').replace('\\011', '\t')
+            .replace('\\012', '\n').replace('\\134', '\\'))
+
+
+# Waits for mount table changes (/proc/self/mounts becomes readable with
+# POLLPRI once it is changed) and network link events (rtnetlink
+# RTMGRP_LINK multicast group).
+class Watcher:
+    def __init__(self, logger):
+        self.logger = logger
+        self.mounts_file = ProcFile('/proc/self/mounts')
+        self.mounts_file.read()
+        self.poll = select.poll()
+        self.poll.register(self.mounts_file.f, select.POLLPRI | select.POLLERR)
+        self.sock = None
+        self.rescan = None
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                      socket.NETLINK_ROUTE)
+            self.sock.bind((0, RTMGRP_LINK))
+            self.sock.setblocking(False)
+            self.poll.register(self.sock, select.POLLIN)
+        except OSError as e:
+            self.logger.warning('Link events are not available: %s', e)
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            self.rescan = time.monotonic() + RESCAN
+
+    # Returns set of changed sources.
+    def wait(self, timeout):
+        changed = set()
+        for fd, _ in self.poll.poll(timeout * 1000):
+            if fd == self.mounts_file.f.fileno():
+                changed.add(MOUNTS)
+            else:
+                self.drain()
+                changed.add(LINKS)
+        if self.rescan is not None and time.monotonic() >= self.rescan:
+            self.rescan = time.monotonic() + RESCAN
+            changed.add(LINKS)
+
+        return changed
+
+    def drain(self):
+        while True:
+            try:
+                self.sock.recv(65536)
+            except BlockingIOError:
+                break
+
+    # Returns device to mountpoint mapping.
+    def mounts(self):
+        mnts = {}
+        for l in self.mounts_file.read().splitlines():
+            fs = l.split()
+            if len(fs) > 1:
+                mnts[unescape(fs[0])] = unescape(fs[1])
+
+        return mnts
+
+    def close(self):
+        self.mounts_file.close()
+        if self.sock is not None:
+            self.sock.close()
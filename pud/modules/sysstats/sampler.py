@@ -0,0 +1,57 @@
+import math
+import array
+import threading
+
+
+# Fixed-size ring buffer of float samples. Once full the oldest samples
+# are overwritten.
+class Ring:
+    def __init__(self, size):
+        self.buf = array.array('d', bytes(8 * size))
+        self.pos = 0
+        self.count = 0
+
+    def add(self, v):
+        self.buf[self.pos] = v
+        self.pos = (self.pos + 1) % len(self.buf)
+        self.count = min(self.count + 1, len(self.buf))
+
+    def values(self):
+        return self.buf[:self.count]
+
+    def reset(self):
+        self.pos = 0
+        self.count = 0
+
+
+# Keeps samples of every series taken between two flushes and reduces them
+# to min, max, average and 95th percentile.
+class Sampler:
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def add(self, name, v):
+        with self.lock:
+            r = self.series.get(name)
+            if r is None:
+                r = self.series[name] = Ring(self.size)
+            r.add(v)
+
+    def remove(self, name):
+        with self.lock:
+            self.series.pop(name, None)
+
+    def take(self, name):
+        with self.lock:
+            r = self.series.get(name)
+            if r is None or not r.count:
+                return None
+            vals = sorted(r.values())
+            r.reset()
+
+        return [('min', vals[0]),
+                ('max', vals[-1]),
+                ('avg', sum(vals) / len(vals)),
+                ('p95', vals[math.ceil(0.95 * len(vals)) - 1])]
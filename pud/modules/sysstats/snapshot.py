@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+# Columns of `cpu` line in /proc/stat.
+CPU = ['user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq',
+       'steal']
+
+
+# Procfs file kept open and read into the same buffer on every update.
+class ProcFile:
+    def __init__(self, path, size=4096):
+        self.path = path
+        self.f = None
+        self.buf = bytearray(size)
+
+    def read(self):
+        if self.f is None:
+            self.f = open(self.path, 'rb', buffering=0)
+        self.f.seek(0)
+        n = 0
+        while True:
+            m = self.f.readinto(memoryview(self.buf)[n:])
+            if not m:
+                break
+            n += m
+            if n == len(self.buf):
+                self.buf.extend(bytes(len(self.buf)))
+
+        return bytes(memoryview(self.buf)[:n]).decode('utf-8', 'replace')
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+# Single snapshot of system counters shared by all SysStats gauges. Every
+# source file is read once per update no matter how many interfaces and
+# disks are reported. Units match psutil's ones: seconds for CPU times and
+# bytes for memory, network and disk values.
+class Snapshot:
+    def __init__(self):
+        self.files = {n: ProcFile('/proc/' + n)
+                      for n in ('stat', 'meminfo', 'net/dev', 'loadavg',
+                                'uptime')}
+        self.lock = threading.Lock()
+        self.owners = {}
+        self.mounts = set()
+        self.time = 0
+        self.cpu = {}
+        self.mem = {}
+        self.net = {}
+        self.hdd = {}
+        self.la = ()
+        self.uptime = 0
+
+    # Sets mountpoints disk usage is read for on behalf of owner. Snapshot
+    # can be shared, so usage of mountpoints of all owners is read.
+    def watch(self, owner, mountpoints):
+        with self.lock:
+            self.owners[owner] = set(mountpoints)
+            if not self.owners[owner]:
+                del self.owners[owner]
+            self.mounts = set().union(*self.owners.values())
+            self.hdd = {m: u for m, u in self.hdd.items() if m in self.mounts}
+
+    def update(self):
+        with self.lock:
+            self.time = time.monotonic()
+            self.cpu = self.read_cpu()
+            self.mem = self.read_mem()
+            self.net = self.read_net()
+            self.la = tuple(float(x) for x in
+                            self.files['loadavg'].read().split()[:3])
+            self.uptime = float(self.files['uptime'].read().split()[0])
+            self.hdd = {m: self.read_hdd(m) for m in self.mounts}
+
+    # Consistent (time, cpu, net) view of the last update.
+    def counters(self):
+        with self.lock:
+            return self.time, self.cpu, self.net
+
+    def read_cpu(self):
+        data = self.files['stat'].read()
+        vals = data[:data.index('\n')].split()[1:]
+
+        return {n: int(v) / CLK_TCK for n, v in zip(CPU, vals)}
+
+    def read_mem(self):
+        m = {}
+        for l in self.files['meminfo'].read().splitlines():
+            n, v = l.split(':', 1)
+            m[n] = int(v.split()[0]) * 1024
+
+        total = m['MemTotal']
+        free = m['MemFree']
+        buffers = m.get('Buffers', 0)
+        cached = m.get('Cached', 0) + m.get('SReclaimable', 0)
+        available = m.get('MemAvailable', free + buffers + cached)
+        used = total - available
+        if used < 0:
+            used = total - free
+
+        return {'available': available,
+                'buffers': buffers,
+                'cached': cached,
+                'free': free,
+                'shared': m.get('Shmem', 0),
+                'total': total,
+                'used': used}
+
+    def read_net(self):
+        net = {}
+        for l in self.files['net/dev'].read().splitlines()[2:]:
+            iface, vals = l.split(':', 1)
+            vals = vals.split()
+            net[iface.strip()] = {'data_rx': int(vals[0]),
+                                  'data_tx': int(vals[8])}
+
+        return net
+
+    def read_hdd(self, mountpoint):
+        try:
+            st = os.statvfs(mountpoint)
+        except OSError:
+            return None
+
+        return {'total': st.f_blocks * st.f_frsize,
+                'used': (st.f_blocks - st.f_bfree) * st.f_frsize,
+                'free': st.f_bavail * st.f_frsize}
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
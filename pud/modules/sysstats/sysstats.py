@@ -1,102 +1,176 @@
 import re
-import psutil
-import pyrite
+import math
 import pud.modules
 import pud.config
+import pud.metrics
+import pud.sources
+from .snapshot import Snapshot
+from .sampler import Sampler
+from . import discovery
 
 
-def tuples(obj, names):
-    l = []
-    for n, p in names.items():
-        l.append((n, getattr(obj, p)))
+# CPU times reported as sampled usage percents.
+SAMPLED_CPU = ['user', 'system', 'iowait']
+# Snapshot taken less than TTL seconds ago is reused by other instances.
+TTL = 0.5
 
-    return l
+
+def items(d, names=None):
+    if d is None:
+        return None
+
+    return [(n, d[n]) for n in (names or d)]
 
 
 class SysStats(pud.Module):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        host = pud.config.get_required(self.config, 'graphite.host', str)
-        prefix = pud.config.get_required(self.config, 'graphite.prefix', str)
-        interval = pud.config.get(self.config, 'graphite.interval', int, 60)
-        self.graphite = pyrite.Pyrite(host, 2003,
-                                      prefix=prefix,
-                                      interval=interval)
+        self.proc = pud.sources.acquire('proc', Snapshot)
+        self.snap = self.proc.conn
+        self.graphite = pud.metrics.graphite(self.config)
+        self.graphite.hook(self.update)
+        self.rate = pud.config.get(self.config, 'sample.interval', int, 0)
+        if self.rate < 0:
+            raise pud.config.ConfigurationError(
+                'Property `sample.interval` must not be negative.')
+        self.sampler = Sampler(
+            math.ceil(self.graphite.interval / self.rate) if self.rate else 0)
+        self.devices = {}
+        for n, d in self.config.items():
+            m = re.fullmatch(r'hdd\.(.+)\.dev', n)
+            if m:
+                self.devices[m.group(1)] = d
+        self.disks = {}
+        # Names of configured disks which are not mounted.
+        self.unmounted = set()
+        self.ifaces = set()
+        self.watcher = discovery.Watcher(self.logger)
 
         self.register_metrics()
 
     def close(self):
         self.graphite.close()
+        self.watcher.close()
+        self.snap.watch(self, ())
+        pud.sources.release(self.proc)
 
-    # Periodically check for new devices.
-    @pud.cron('*/5 * * * *')
-    def register_metrics(self):
-        mnts = self.mountpoints()
-        for n, d in self.config.items():
-            m = re.search(r'hdd\.(.+)\.dev', n)
-            if m:
-                if d not in mnts:
-                    self.logger.warn('Mountpoint for %d device not found.', d)
-                else:
-                    self.graphite.gauge('hdd.{}'.format(m.group(1)),
-                                        self.hdd(mnts[d]))
-
-        for iface in psutil.net_io_counters(True).keys():
-            if iface == 'lo':
-                continue
-            self.graphite.gauges('net.{}'.format(iface), self.net(iface))
+    def update(self, ttl=TTL):
+        self.proc.query('update', Snapshot.update, ttl)
 
+    def register_metrics(self):
+        self.update_disks()
+        self.update_ifaces()
         self.graphite.gauges('cpu', self.cpu)
         self.graphite.gauges('mem', self.mem)
         self.graphite.gauge('uptime', self.uptime)
 
-    def mountpoints(self):
-        return {x.device: x.mountpoint for x in psutil.disk_partitions()}
+    # Updates disk and interface metrics when mount table or network links
+    # change.
+    @pud.task
+    def discover(self):
+        while not self.term.is_set():
+            changed = self.watcher.wait(1)
+            if discovery.MOUNTS in changed:
+                self.update_disks()
+            if discovery.LINKS in changed:
+                self.update_ifaces()
+
+    def update_disks(self):
+        mnts = self.watcher.mounts()
+        for n, d in self.devices.items():
+            mnt = mnts.get(d)
+            if mnt is None:
+                # Warned once, including a device not mounted at startup.
+                if n not in self.unmounted:
+                    self.logger.warning('Mountpoint for %s device not found.',
+                                        d)
+                    self.unmounted.add(n)
+                if self.disks.pop(n, None) is not None:
+                    self.graphite.remove('hdd.' + n)
+                continue
+            self.unmounted.discard(n)
+            if mnt == self.disks.get(n):
+                continue
+            self.logger.info('Device %s is mounted on %s.', d, mnt)
+            self.disks[n] = mnt
+            self.graphite.gauges('hdd.' + n, self.hdd(mnt))
+        self.snap.watch(self, self.disks.values())
+
+    def update_ifaces(self):
+        self.update(0)
+        ifaces = set(self.snap.counters()[2]) - {'lo'}
+        for iface in ifaces - self.ifaces:
+            self.logger.info('Network interface %s added.', iface)
+            self.graphite.gauges('net.' + iface, self.net(iface))
+        for iface in self.ifaces - ifaces:
+            self.logger.info('Network interface %s removed.', iface)
+            self.graphite.remove('net.' + iface)
+            for n in ('data_rx', 'data_tx'):
+                name = 'net.{}.{}'.format(iface, n)
+                self.sampler.remove(name)
+                self.graphite.remove('sample.' + name)
+        self.ifaces = ifaces
+
+    # Samples CPU usage and network rates every sample.interval seconds.
+    # Min, max, average and 95th percentile of samples taken during the
+    # last graphite.interval are reported under `sample` prefix.
+    @pud.task
+    def sample(self):
+        if not self.rate:
+            return
+
+        prev = None
+        while not self.term.wait(self.rate):
+            self.update()
+            cur = self.snap.counters()
+            if prev is not None:
+                self.add_samples(prev, cur)
+            prev = cur
+
+    def add_samples(self, prev, cur):
+        dt = cur[0] - prev[0]
+        if dt <= 0:
+            return
+
+        total = sum(cur[1].values()) - sum(prev[1].values())
+        for n in SAMPLED_CPU:
+            if total > 0:
+                self.add_sample('cpu.' + n,
+                                (cur[1][n] - prev[1][n]) * 100 / total)
+        for iface, c in cur[2].items():
+            p = prev[2].get(iface)
+            if iface == 'lo' or p is None:
+                continue
+            for n in ('data_rx', 'data_tx'):
+                self.add_sample('net.{}.{}'.format(iface, n),
+                                (c[n] - p[n]) / dt)
+
+    def add_sample(self, name, v):
+        if name not in self.sampler.series:
+            self.graphite.gauges('sample.' + name,
+                                 lambda: self.sampler.take(name))
+        self.sampler.add(name, v)
 
     def uptime(self):
-        with open('/proc/uptime', 'r') as f:
-            return int(float(f.readline().split()[0]))
+        return int(self.snap.uptime)
 
-    def hdd(self, dev):
+    def hdd(self, mountpoint):
         def f():
-            st = psutil.disk_usage(dev)
-
-            return tuples(st,
-                          {'total': 'total',
-                           'used': 'used',
-                           'free': 'free'})
+            return items(self.snap.hdd.get(mountpoint))
 
         return f
 
     def net(self, iface):
         def f():
-            c = psutil.net_io_counters(True)
-            if iface not in c:
-                return None
-
-            return tuples(c[iface],
-                          {'data_rx': 'bytes_recv',
-                           'data_tx': 'bytes_sent'})
+            return items(self.snap.net.get(iface))
 
         return f
 
     def cpu(self):
-        times = tuples(psutil.cpu_times(),
-                       {'user': 'user',
-                        'system': 'system',
-                        'idle': 'idle',
-                        'iowait': 'iowait'})
-        st = psutil.getloadavg()
-        la = [('la1', st[0]), ('la5', st[1]), ('la15', st[2])]
+        la = self.snap.la
+        times = items(self.snap.cpu, ['user', 'system', 'idle', 'iowait'])
 
-        return times + la
+        return times + [('la1', la[0]), ('la5', la[1]), ('la15', la[2])]
 
     def mem(self):
-        return tuples(psutil.virtual_memory(),
-                      {'available': 'available',
-                       'buffers': 'buffers',
-                       'cached': 'cached',
-                       'free': 'free',
-                       'shared': 'shared',
-                       'total': 'total',
-                       'used': 'used'})
+        return items(self.snap.mem)
@@ -0,0 +1,127 @@
+import json
+import collections
+import http.client
+import pud.config
+import pud.sources
+import pud.keepalive
+
+
+Torrent = collections.namedtuple('Torrent',
+                                 ['hash', 'name', 'comment', 'peers'])
+Peer = collections.namedtuple('Peer', ['ip', 'client', 'speed'])
+
+# Errors of a failed request.
+ERRORS = (IOError, OSError, ValueError, http.client.HTTPException)
+# Default lifetime of shared query results.
+TTL = 5
+# Stock RPC URL of transmission-daemon.
+PATH = '/transmission/rpc'
+
+
+# Transmission RPC client keeping a single keep-alive connection and the
+# session id between requests.
+class Transmission:
+    SID_HEADER = 'X-Transmission-Session-Id'
+    TIMEOUT = 30
+    FIELDS = ['hashString', 'name', 'comment', 'peers']
+
+    def __init__(self, host, port, path=PATH):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.sid = ''
+        self.conn = None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # Requests torrents in the compact table format. Peers which are not
+    # uploaded to are dropped by the JSON decoder already, so no dicts are
+    # kept for them.
+    def get_torrents(self):
+        resp = self.request('torrent-get',
+                            {'ids': 'recently-active',
+                             'fields': self.FIELDS,
+                             'format': 'table'},
+                            object_hook=peer)
+        rows = resp['torrents']
+        if rows and isinstance(rows[0], dict):
+            # Old servers ignore format argument and return objects.
+            rows = [[r[f] for f in self.FIELDS] for r in rows]
+        elif rows:
+            idx = [rows[0].index(f) for f in self.FIELDS]
+            rows = [[r[i] for i in idx] for r in rows[1:]]
+
+        torrents = []
+        for hash, name, comment, peers in rows:
+            peers = [p for p in peers if p is not None]
+            if peers:
+                torrents.append(Torrent(hash=hash,
+                                        name=name,
+                                        comment=comment,
+                                        peers=peers))
+
+        return torrents
+
+    def session_stats(self):
+        return self.request('session-stats', {})
+
+    def request(self, method, args, object_hook=None):
+        body = json.dumps({'method': method,
+                           'arguments': args})
+        retry = 2
+        while retry:
+            status, sid, data = self.post(body)
+            if status == 200:
+                resp = json.loads(data, object_hook=object_hook)
+                if resp['result'] != 'success':
+                    raise IOError('request failed: {}'.format(resp['result']))
+                return resp['arguments']
+            elif status == 409:
+                self.sid = sid
+                retry -= 1
+            else:
+                raise IOError('non-OK server response: {}'.format(status))
+
+        raise IOError('session id negotiation failed')
+
+    def post(self, body):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port,
+                                                   timeout=self.TIMEOUT)
+        # Closed connection reconnects on the next request.
+        _, resp = pud.keepalive.request(
+            self.conn, lambda: self.conn, 'POST', self.path, body=body,
+            headers={self.SID_HEADER: self.sid,
+                     'Content-Type': 'application/json'})
+
+        return resp.status, resp.getheader(self.SID_HEADER), resp.read()
+
+
+def peer(obj):
+    if 'isUploadingTo' not in obj:
+        return obj
+    if not obj['isUploadingTo']:
+        return None
+
+    return Peer(ip=obj['address'],
+                client=obj['clientName'],
+                speed=obj['rateToPeer'])
+
+
+# Returns shared source of the transmission-daemon given in config. `path`
+# is the default RPC URL of the module.
+def source(config, path=PATH):
+    host = pud.config.get_required(config, 'transmission.host', str)
+    port = pud.config.get_required(config, 'transmission.port', int)
+    path = pud.config.get(config, 'transmission.path', str, path)
+
+    return pud.sources.acquire(
+        'transmission-{}-{}{}'.format(host, port, path),
+        lambda: Transmission(host, port, path))
+
+
+def ttl(config):
+    return pud.config.get(config, 'transmission.ttl', int, TTL)
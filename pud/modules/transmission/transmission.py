@@ -1,27 +1,25 @@
 import threading
-import pyrite
-import transmission_rpc
 import pud.modules
 import pud.config
+import pud.metrics
+import pud.sources
+from . import rpc
 
 
 class Transmission(pud.Module):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        ghost = pud.config.get_required(self.config, 'graphite.host', str)
-        gprefix = pud.config.get_required(self.config, 'graphite.prefix', str)
-        ginterval = pud.config.get(self.config, 'graphite.interval', int, 60)
-        self.graphite = pyrite.Pyrite(ghost, 2003,
-                                      prefix=gprefix,
-                                      interval=ginterval)
-        self.host = pud.config.get_required(self.config, 'transmission.host', str)
-        self.port = pud.config.get_required(self.config, 'transmission.port', int)
+        self.graphite = pud.metrics.graphite(self.config)
+        self.tr = rpc.source(self.config)
+        self.ttl = rpc.ttl(self.config)
+        self.graphite.gauges('rpc', self.tr.stats)
 
         self.stats = {}
         self.statsmu = threading.Lock()
 
     def close(self):
         self.graphite.close()
+        pud.sources.release(self.tr)
 
     @pud.cron('* * * * *')
     def update_stats(self):
@@ -38,24 +36,24 @@ class Transmission(pud.Module):
             self.register_gauge('uptime')
             self.register_gauge('torrents_total')
             self.register_gauge('torrents_active')
-        except transmission_rpc.TransmissionError as e:
+        except rpc.ERRORS as e:
             self.logger.error('%s', e)
             with self.statsmu:
                 self.stats['speed_rx'] = 0
                 self.stats['speed_tx'] = 0
 
     def get_stats(self):
-        with transmission_rpc.Client(host=self.host, port=self.port) as tr:
-            stats = dict(tr.session_stats().items())
-
-            return {'speed_rx': stats['downloadSpeed'],
-                    'speed_tx': stats['uploadSpeed'],
-                    'data_rx': stats['cumulative_stats']['downloadedBytes'],
-                    'data_tx': stats['cumulative_stats']['uploadedBytes'],
-                    'uptime_total': stats['cumulative_stats']['secondsActive'],
-                    'uptime': stats['current_stats']['secondsActive'],
-                    'torrents_total': stats['torrentCount'],
-                    'torrents_active': stats['activeTorrentCount']}
+        stats = self.tr.query('session-stats',
+                              rpc.Transmission.session_stats, self.ttl)
+
+        return {'speed_rx': stats['downloadSpeed'],
+                'speed_tx': stats['uploadSpeed'],
+                'data_rx': stats['cumulative-stats']['downloadedBytes'],
+                'data_tx': stats['cumulative-stats']['uploadedBytes'],
+                'uptime_total': stats['cumulative-stats']['secondsActive'],
+                'uptime': stats['current-stats']['secondsActive'],
+                'torrents_total': stats['torrentCount'],
+                'torrents_active': stats['activeTorrentCount']}
 
     def register_gauge(self, name):
         def func():
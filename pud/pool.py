@@ -0,0 +1,73 @@
+import time
+import queue
+import logging
+import threading
+
+
+logger = logging.getLogger('pud')
+
+
+class Pool:
+    def __init__(self, size):
+        self.size = size
+        self.jobs = queue.SimpleQueue()
+        self.workers = []
+        self.idle = 0
+        # Submitted jobs not taken by a worker yet.
+        self.pending = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args):
+        with self.lock:
+            if self.closed:
+                logger.warning('Worker pool is closed. Dropping %s.', func)
+                return
+            self.jobs.put((func, args))
+            self.pending += 1
+            # Idle workers take queued jobs one each, so a new worker is
+            # needed once there are more queued jobs than idle workers.
+            if self.pending > self.idle and len(self.workers) < self.size:
+                name = 'worker-{}'.format(len(self.workers))
+                t = threading.Thread(target=self.work, daemon=True,
+                                     name=name)
+                self.workers.append(t)
+                t.start()
+
+    def work(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+            job = self.jobs.get()
+            with self.lock:
+                self.idle -= 1
+                if job is not None:
+                    self.pending -= 1
+            if job is None:
+                break
+
+            func, args = job
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('Worker job %s failed.', func)
+
+    def workers_count(self):
+        with self.lock:
+            return len(self.workers)
+
+    def busy_count(self):
+        with self.lock:
+            return len(self.workers) - self.idle
+
+    def close(self, timeout):
+        with self.lock:
+            self.closed = True
+            workers = list(self.workers)
+            for _ in workers:
+                self.jobs.put(None)
+        deadline = time.monotonic() + timeout
+        for t in workers:
+            t.join(max(deadline - time.monotonic(), 0))
+            if t.is_alive():
+                logger.warning('%s did not exited. Ignoring.', t.name)
@@ -0,0 +1,303 @@
+import os
+import sys
+import time
+import queue
+import socket
+import logging
+import threading
+import traceback
+import collections
+import pud.config
+
+
+logger = logging.getLogger('pud')
+
+DIR = '/var/log/pud'
+DURATION = 30
+# Sampling interval in milliseconds.
+INTERVAL = 10
+# Maximum profile duration accepted from the control socket.
+MAX_DURATION = 600
+
+defaults = pud.config.Config(None)
+process = 'main'
+# Commands from signal handlers. SimpleQueue.put() can be safely called
+# from a signal handler, so the handlers only queue commands and the
+# dispatcher thread executes them.
+commands = queue.SimpleQueue()
+dispatcher = None
+control = None
+lock = threading.Lock()
+running = None
+# Threads of the profiler itself which are not sampled.
+ignored = set()
+
+
+# Wall-clock sampling profile of all threads. Stacks of every thread are
+# taken each `interval` seconds with sys._current_frames() and counted by
+# thread name. Cron tasks rename worker threads running them (see
+# pud.pud.CronTask.run()) and long task threads are named after the task,
+# so samples are attributed to tasks. Idle workers are not sampled.
+class Profile(threading.Thread):
+    def __init__(self, path, duration, interval):
+        super().__init__(daemon=True, name='profile')
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.error = None
+
+    def run(self):
+        global running
+        ignored.add(threading.get_ident())
+        try:
+            self.sample()
+            self.write()
+            logger.info('Profile written to %s.', self.path)
+        except OSError as e:
+            self.error = e
+            logger.error('Writing profile %s failed: %s', self.path, e)
+        finally:
+            ignored.discard(threading.get_ident())
+            with lock:
+                running = None
+
+    def sample(self):
+        start = time.monotonic()
+        while time.monotonic() - start < self.duration:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident)
+                if (name is None or ident in ignored
+                        or name.startswith('worker-')):
+                    continue
+                self.stacks[(name, stack(frame))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        self.elapsed = time.monotonic() - start
+
+    # Writes samples grouped by module and task with the functions most of
+    # the samples were taken in. All stacks are written in the collapsed
+    # format, accepted by flame graph tools, to the .folded file.
+    def write(self):
+        tasks = collections.Counter()
+        funcs = collections.defaultdict(collections.Counter)
+        for (name, st), n in self.stacks.items():
+            tasks[name] += n
+            if st:
+                funcs[name][st[-1]] += n
+        modules = collections.defaultdict(list)
+        for name, n in tasks.most_common():
+            modules[name.rsplit('.', 1)[0]].append((name, n))
+
+        with open(self.path, 'w') as f:
+            f.write('Profile of {} process: {} samples in {:.1f} seconds, '
+                    'every {} ms.\n'.format(process, self.samples,
+                                            self.elapsed,
+                                            self.interval * 1000))
+            f.write('Percents are parts of samples a thread was seen '
+                    'in a function, idle or not.\n')
+            for mod, ts in sorted(modules.items(),
+                                  key=lambda m: -sum(n for _, n in m[1])):
+                f.write('\n{}: {} samples\n'.format(
+                    mod, sum(n for _, n in ts)))
+                for name, n in ts:
+                    f.write('  {}: {} samples ({})\n'.format(
+                        name, n, percent(n, self.samples)))
+                    for fn, c in funcs[name].most_common(10):
+                        f.write('    {:>6} {:>7}  {}\n'.format(
+                            c, percent(c, self.samples), func(fn)))
+
+        lines = sorted('{} {}\n'.format(';'.join([name] + list(map(func, st))),
+                                       n)
+                       for (name, st), n in self.stacks.items())
+        with open(os.path.splitext(self.path)[0] + '.folded', 'w') as f:
+            f.writelines(lines)
+
+
+# Returns stack of the frame from the outermost call as tuple of code
+# objects.
+def stack(frame):
+    st = []
+    while frame is not None:
+        st.append(frame.f_code)
+        frame = frame.f_back
+    st.reverse()
+
+    return tuple(st)
+
+
+def func(code):
+    return '{} ({}:{})'.format(code.co_name,
+                               os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+def percent(n, total):
+    return '{:.1f}%'.format(n / total * 100 if total else 0)
+
+
+def path(kind):
+    return os.path.join(pud.config.get(defaults, 'profile.dir', str, DIR),
+                        '{}-{}-{}.txt'.format(
+                            kind, process, time.strftime('%Y%m%d-%H%M%S')))
+
+
+# Starts profiling for `duration` seconds. Returns the profile thread or
+# None if another profile is running already.
+def profile(duration=None):
+    global running
+    if duration is None:
+        duration = pud.config.get(defaults, 'profile.duration', int,
+                                  DURATION)
+    interval = pud.config.get(defaults, 'profile.interval', int,
+                              INTERVAL) / 1000
+    with lock:
+        if running is not None:
+            logger.warning('Profile %s is still running.', running.path)
+            return None
+        running = Profile(path('profile'), duration, interval)
+        running.start()
+        logger.info('Profiling for %d seconds.', duration)
+
+        return running
+
+
+# Writes stacks of all threads to a file and returns its path.
+def stacks():
+    p = path('stacks')
+    names = {t.ident: t.name for t in threading.enumerate()}
+    frames = sys._current_frames()
+    try:
+        with open(p, 'w') as f:
+            for ident, frame in frames.items():
+                f.write('Thread {} ({}):\n'.format(names.get(ident, '?'),
+                                                   ident))
+                f.write(''.join(traceback.format_stack(frame)))
+                f.write('\n')
+    except OSError as e:
+        logger.error('Writing thread stacks %s failed: %s', p, e)
+        return None
+    logger.info('Thread stacks written to %s.', p)
+
+    return p
+
+
+def on_sigusr1(sig, frame):
+    commands.put(('profile', None))
+
+
+def on_sigusr2(sig, frame):
+    commands.put(('stacks', None))
+
+
+def dispatch():
+    ignored.add(threading.get_ident())
+    while True:
+        cmd = commands.get()
+        if cmd is None:
+            break
+        try:
+            if cmd[0] == 'profile':
+                profile(cmd[1])
+            else:
+                stacks()
+        except Exception:
+            logger.exception('Command %s failed.', cmd[0])
+
+
+# Local control socket accepting one command per connection:
+#
+#     profile [seconds]  profile for the given number of seconds and
+#                        reply with the profile path once it is written
+#     stacks             write thread stacks and reply with the file path
+#
+# Replies are single lines starting with `ok` or `error`.
+class Control(threading.Thread):
+    def __init__(self, path):
+        super().__init__(daemon=True, name='profile-control')
+        self.path = path
+        if os.path.exists(path):
+            os.remove(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        os.chmod(path, 0o600)
+        self.sock.listen()
+
+    def run(self):
+        ignored.add(threading.get_ident())
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve, args=(conn,), daemon=True,
+                             name='profile-client').start()
+
+    def serve(self, conn):
+        ignored.add(threading.get_ident())
+        try:
+            with conn, conn.makefile('rw') as f:
+                f.write(self.execute(f.readline().split()) + '\n')
+        except OSError as e:
+            logger.warning('Control connection failed: %s', e)
+        finally:
+            ignored.discard(threading.get_ident())
+
+    def execute(self, args):
+        if args == ['stacks']:
+            p = stacks()
+            return 'ok ' + p if p else 'error writing stacks failed'
+        if not args or args[0] != 'profile' or len(args) > 2:
+            return 'error unknown command'
+        duration = None
+        if len(args) == 2:
+            if not args[1].isdigit() or not 0 < int(args[1]) <= MAX_DURATION:
+                return 'error duration must be 1-{} seconds'.format(
+                    MAX_DURATION)
+            duration = int(args[1])
+        p = profile(duration)
+        if p is None:
+            return 'error profile is already running'
+        p.join()
+        if p.error is not None:
+            return 'error {}'.format(p.error)
+
+        return 'ok ' + p.path
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# Starts the command dispatcher and, in the main process, the control
+# socket if `control.socket` is set.
+def configure(daemon_cfg, proc='main'):
+    global defaults, process, dispatcher, control
+    defaults = daemon_cfg
+    process = proc
+    sockpath = pud.config.get(daemon_cfg, 'control.socket', str)
+    pud.config.get(daemon_cfg, 'profile.duration', int)
+    pud.config.get(daemon_cfg, 'profile.interval', int)
+
+    dispatcher = threading.Thread(target=dispatch, daemon=True,
+                                  name='profile-dispatcher')
+    dispatcher.start()
+    if sockpath is not None and proc == 'main':
+        try:
+            control = Control(sockpath)
+        except OSError as e:
+            logger.error('Opening control socket %s failed: %s', sockpath, e)
+        else:
+            control.start()
+
+
+def close():
+    if control is not None:
+        control.close()
+    if dispatcher is not None:
+        commands.put(None)
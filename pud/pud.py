@@ -4,99 +4,241 @@ import time
 import signal
 import logging
 import logging.handlers
+import heapq
+import queue
+import itertools
 import importlib
 import threading
+import concurrent.futures
+import zlib
 import croniter
 import pud.modules
 import pud.config
+import pud.pool
+import pud.aio
+import pud.worker
+import pud.telemetry
+import pud.metrics
+import pud.storage
+import pud.spool
+import pud.profile
 
 
 CONFIG_DIR = '/etc/pud'
+WORKERS = 16
+OVERRUNS = ('skip', 'queue', 'coalesce')
+MISFIRE = 60
+STARTUP_TIMEOUT = 30
 LOGGER_DIR = '/var/log/pud'
 LOGGER_FORMAT = '%(asctime)s %(levelname)-8s %(message)s'
 LOGGER_LEVEL = logging.INFO
 
 
 def get_logger(mod='pud'):
+    logger = logging.getLogger(mod)
+    if logger.handlers:
+        return logger
     file = os.path.join(LOGGER_DIR, mod + '.log')
     h = logging.handlers.RotatingFileHandler(file,
                                              maxBytes=1024 * 1024 * 5,
                                              backupCount=5)
     h.setFormatter(logging.Formatter(LOGGER_FORMAT))
-    logger = logging.getLogger(mod)
     logger.addHandler(h)
 
     return logger
 
 
-logging.basicConfig(format=LOGGER_FORMAT, level=LOGGER_LEVEL)
-logger = get_logger()
+# File handlers are added by run(), so importing pud does not need
+# LOGGER_DIR.
+logger = logging.getLogger('pud')
 
-term = threading.Event()
+term = pud.aio.Event()
+# Set on SIGHUP to reload modules configuration.
+hup = threading.Event()
+# Wakes the scheduler loop up on signals.
+wakeup = threading.Event()
+# Modules loaded in background as (cfg, instance, seconds, error) waiting
+# to be started by the main thread.
+loaded = queue.SimpleQueue()
 
 
 class PudError(Exception):
     pass
 
 
+# Removed crons are only marked as cancelled and dropped once they get to
+# the head of the queue.
 class RunQueue:
-    def __init__(self, crons):
+    def __init__(self, crons=()):
         self.queue = []
-        for m, e in crons.items():
-            self.queue.append({'method': m,
-                               'expr': e,
-                               'time': e.get_next()})
-        self.sort()
+        self.seq = itertools.count()
+        for c in crons:
+            self.queue.append((c.next(), next(self.seq), c))
+        heapq.heapify(self.queue)
+
+    def add(self, cron):
+        heapq.heappush(self.queue, (cron.next(), next(self.seq), cron))
+
+    def remove(self, cron):
+        cron.cancelled = True
+
+    def peek(self):
+        while self.queue and self.queue[0][2].cancelled:
+            heapq.heappop(self.queue)
+        if not self.queue:
+            return None
+        t, i, c = self.queue[0]
+
+        return c, t
 
     def next(self):
-        r = self.queue[0]['method'], self.queue[0]['time']
-        self.queue[0]['time'] = self.queue[0]['expr'].get_next()
-        self.sort()
+        c, t = self.peek()
+        heapq.heapreplace(self.queue, (c.next(), next(self.seq), c))
+
+        return c, t
+
+
+class CronTask:
+    def __init__(self, name, method, expr, executor,
+                 concurrency=1, overrun='skip', offset=0, misfire=MISFIRE,
+                 term=term):
+        self.name = name
+        self.method = method
+        self.expr = expr
+        self.executor = executor
+        self.concurrency = concurrency
+        self.overrun = overrun
+        self.offset = offset
+        self.misfire = misfire
+        self.term = term
+        self.cancelled = False
+        self.active = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.stats = pud.telemetry.task(name)
+        if pud.aio.iscoroutine(method):
+            self.run = self.arun
+
+    def next(self):
+        return self.expr.get_next() + self.offset
+
+    def isexpired(self, runtime):
+        return time.time() - runtime > self.misfire
+
+    def fire(self, runtime):
+        with self.lock:
+            if self.active >= self.concurrency:
+                if self.overrun == 'skip':
+                    self.stats.inc('skipped')
+                    logger.warning('Cron task %s is still running. Skipping.',
+                                   self.name)
+                    return
+                elif self.overrun == 'queue':
+                    self.pending += 1
+                else:
+                    self.pending = 1
+                self.stats.inc('postponed')
+                logger.info('Cron task %s is still running. '
+                            'Postponing (%d pending).',
+                            self.name, self.pending)
+                return
+            self.active += 1
+
+        logger.info('Executing cron task %s', self.name)
+        self.executor.submit(self.run, runtime)
+
+    # Worker thread is named after the task while running it, so thread
+    # dumps and profiles show which task the thread is busy with.
+    def run(self, runtime=None):
+        t = threading.current_thread()
+        worker, t.name = t.name, self.name
+        start = self.started(runtime)
+        try:
+            self.method()
+        except Exception as e:
+            self.finished(start, False)
+        else:
+            self.finished(start, True)
+        finally:
+            t.name = worker
+        self.done()
 
-        return r
+    async def arun(self, runtime=None):
+        start = self.started(runtime)
+        try:
+            await self.method()
+        except Exception as e:
+            self.finished(start, False)
+        else:
+            self.finished(start, True)
+        self.done()
 
+    def started(self, runtime):
+        if runtime is not None:
+            self.stats.started(time.time() - runtime)
 
-    def sort(self):
-        self.queue.sort(key=lambda x: x['time'])
+        return time.monotonic()
+
+    def finished(self, start, ok):
+        self.stats.finished(time.monotonic() - start, ok)
+        if ok:
+            logger.info('Cron task %s finished succesfuly.', self.name)
+        else:
+            logger.exception('Cron task %s failed.', self.name)
+
+    def done(self):
+        with self.lock:
+            again = self.pending > 0 and not self.term.is_set()
+            if again:
+                self.pending -= 1
+            else:
+                self.pending = 0
+                self.active -= 1
+        if again:
+            logger.info('Executing postponed cron task %s', self.name)
+            self.executor.submit(self.run)
+
+    def isbusy(self):
+        with self.lock:
+            return self.active > 0
 
 
 class TaskThread(threading.Thread):
-    def __init__(self, target, *args, **kwargs):
-        super().__init__(target=self.withretry(target), daemon=True,
-                         *args, **kwargs)
+    def __init__(self, name, target, *args, **kwargs):
+        super().__init__(target=self.withretry(name, target), daemon=True,
+                         name=name, *args, **kwargs)
+
+    def withretry(self, name, target):
+        stats = pud.telemetry.task(name)
 
-    def withretry(self, target):
         def wrapper(*args, **kwargs):
             while True:
                 try:
                     target(*args, **kwargs)
                     break
                 except Exception as e:
-                    logger.exception('Long task %s failed. Retrying.', target)
+                    stats.inc('retries')
+                    logger.exception('Long task %s failed. Retrying.', name)
                 time.sleep(1)
 
-            logger.info('Long task %s finished successfuly.', target)
+            logger.info('Long task %s finished successfuly.', name)
 
         return wrapper
 
 
-class CronThread(threading.Thread):
-    def __inti__(self, *args, **kwargs):
-        super().__init__(daemon=True, *args, **kwargs)
-
-    def run(self, *args, **kwargs):
-        t = self._target
-
+async def async_task(name, target):
+    import asyncio
+    stats = pud.telemetry.task(name)
+    while True:
         try:
-            super().run(*args, **kwargs)
+            await target()
+            break
         except Exception as e:
-            logger.exception('Cron task %s failed.', t)
-        else:
-            logger.info('Cron task %s finished succesfuly.', t)
-
+            stats.inc('retries')
+            logger.exception('Long task %s failed. Retrying.', name)
+        await asyncio.sleep(1)
 
-def isexpired(t):
-    return time.time() - t > 60
+    logger.info('Long task %s finished successfuly.', name)
 
 
 def module(name):
@@ -113,6 +255,11 @@ def module(name):
     return getattr(m, m.__all__[0])
 
 
+def taskname(meth):
+    return '{}.{}'.format(pud.config.name(meth.__self__.config),
+                          meth.__name__)
+
+
 def methods(obj):
     ms = []
     for m in dir(obj):
@@ -150,84 +297,478 @@ def die(fmt, *args):
 def on_sigterm(sig, frame):
     logger.info('Got TERM signal. Exiting.')
     term.set()
+    wakeup.set()
+
+
+def on_sighup(sig, frame):
+    logger.info('Got HUP signal. Reloading configuration.')
+    hup.set()
+    wakeup.set()
+
+
+def cron_task(cfg, daemon_cfg, meth, expr, executor):
+    name = taskname(meth)
+
+    def option(name, prop_type, value, default):
+        if value is None:
+            value = pud.config.get(daemon_cfg, name, prop_type, default)
+
+        return pud.config.get(cfg, name, prop_type, value)
+
+    concurrency = option('cron.concurrency', int,
+                         meth.pud_concurrency, 1)
+    overrun = option('cron.overrun', str, meth.pud_overrun, 'skip')
+    offset = option('cron.offset', int, None, 0)
+    jitter = option('cron.jitter', int, None, 0)
+    misfire = option('cron.misfire', int, None, MISFIRE)
+    if concurrency < 1:
+        raise pud.config.ConfigurationError(
+            'Property `cron.concurrency` must be positive.')
+    if jitter < 0 or misfire < 0:
+        raise pud.config.ConfigurationError(
+            'Properties `cron.jitter` and `cron.misfire` '
+            'must not be negative.')
+    if overrun not in OVERRUNS:
+        raise pud.config.ConfigurationError(
+            'Property `cron.overrun` must be one of: {}.'.format(
+                ', '.join(OVERRUNS)))
+    try:
+        expr = croniter.croniter(expr)
+    except croniter.CroniterBadCronError as e:
+        raise PudError('Parsing cron expression for {} failed: {}'.format(
+            name, e))
 
+    return CronTask(name, meth, expr, executor, concurrency, overrun,
+                    offset + spread(name, jitter), misfire,
+                    meth.__self__.term)
 
-def run():
-    logger.info('Starging.')
 
-    signal.signal(signal.SIGTERM, on_sigterm)
+# Deterministic per-task delay in [0, jitter) seconds. Derived from the task
+# name, so it does not change between restarts while tasks sharing the same
+# schedule get spread over the jitter window.
+def spread(name, jitter):
+    return zlib.crc32(name.encode('utf-8')) / 2 ** 32 * jitter
 
-    try:
-        cfgs = pud.config.load_configs(os.path.join(CONFIG_DIR, 'modules'))
-    except pud.config.SyntaxError as e:
-        die('Loading configuration failed: %s', e)
 
-    tasks = []
-    crons = {}
+# Instance names are used for log files, task names and spools, so they
+# must be unique.
+def check_names(cfgs):
+    paths = {}
+    for cfg in cfgs:
+        name = pud.config.name(cfg)
+        if name in paths:
+            raise PudError('Module name {} is used in {} and {}.'.format(
+                name, paths[name], cfg.path))
+        paths[name] = cfg.path
+
+
+def isprocess(cfg):
+    return pud.config.get(cfg, 'process', bool, False)
+
+
+# Modules list resources which must have a single owner, like a database
+# they assign ids in, with an `owned(config)` static method. Instances
+# sharing such a resource share its owner within a process, so none of
+# them can run in a separate process. Module classes are imported only if
+# some module runs in a separate process.
+def check_owned(cfgs):
+    if not any(isprocess(c) for c in cfgs):
+        return
+    users = {}
     for cfg in cfgs:
         if 'module' not in cfg:
-            die('Required `module` property is missing in %s', cfg.path)
-        name = cfg['module']
-        logger.info('Initializing %s module.', name) # TODO: Info level. Check others.
+            continue
+        owned = getattr(module(cfg['module']), 'owned', None)
+        if owned is None:
+            continue
+        for r in owned(cfg):
+            users.setdefault(r, []).append(cfg)
+    for r, cs in users.items():
+        if len(cs) > 1 and any(isprocess(c) for c in cs):
+            raise PudError('Modules {} share {} and can not run in '
+                           'separate processes.'.format(
+                               ', '.join(pud.config.name(c) for c in cs), r))
+
+
+def load_module(cfg, logger):
+    if 'module' not in cfg:
+        raise PudError('Required `module` property is missing in {}'.format(
+            cfg.path))
+    mod_cls = module(cfg['module'])
+
+    # Every module gets its own term event, so it can be stopped alone.
+    return mod_cls(term=pud.aio.Event(), logger=logger, config=cfg)
+
+
+class Scheduler:
+    def __init__(self, daemon_cfg, process='main'):
+        self.daemon_cfg = daemon_cfg
+        workers = pud.config.get(daemon_cfg, 'workers', int, WORKERS)
+        if workers < 1:
+            raise pud.config.ConfigurationError(
+                'Property `workers` must be positive.')
+        self.pool = pud.pool.Pool(workers)
+        self.graphite = pud.telemetry.publish(daemon_cfg, process, self.pool)
+        self.aio = None
+        self.mods = []
+        self.tasks = {}
+        self.crons = []
+        self.stopping = []
+        self.runq = RunQueue()
+
+    def executor(self, meth):
+        if not pud.aio.iscoroutine(meth):
+            return self.pool
+        if self.aio is None:
+            self.aio = pud.aio.Loop()
+
+        return self.aio
+
+    def add(self, mod):
+        crons = []
+        for meth, expr in module_crons(mod).items():
+            crons.append(cron_task(mod.config, self.daemon_cfg, meth, expr,
+                                   self.executor(meth)))
+            logger.info('Registered %s cron task.', taskname(meth))
+        tasks = module_tasks(mod)
+        for meth in tasks:
+            logger.info('Registered %s long task.', taskname(meth))
+
+        self.mods.append(mod)
+        self.crons.extend(crons)
+        for c in crons:
+            self.runq.add(c)
+        for task in tasks:
+            name = taskname(task)
+            logger.info('Executing long task %s', name)
+            if pud.aio.iscoroutine(task):
+                self.tasks[task] = self.executor(task).submit(async_task,
+                                                              name, task)
+            else:
+                t = TaskThread(name, target=task)
+                t.start()
+                self.tasks[task] = t
+
+    # Stops module's cron and long tasks and closes it. Other modules keep
+    # running. Module is detached at once and waited for in background, so
+    # the scheduler thread is not blocked while it exits.
+    def remove(self, mod, timeout=5):
+        mod.term.set()
+        crons = [c for c in self.crons if c.method.__self__ is mod]
+        for c in crons:
+            self.runq.remove(c)
+        self.crons = [c for c in self.crons if c.method.__self__ is not mod]
+        tasks = {m: t for m, t in self.tasks.items() if m.__self__ is mod}
+        for m in tasks:
+            del self.tasks[m]
+        self.mods.remove(mod)
+        self.background('stop-' + pud.config.name(mod.config),
+                        lambda: self.retire(mod, crons, tasks, timeout))
+
+    def retire(self, mod, crons, tasks, timeout):
+        deadline = time.monotonic() + timeout
+        busy = False
+        for meth, t in tasks.items():
+            left = max(0, deadline - time.monotonic())
+            if isinstance(t, threading.Thread):
+                t.join(left)
+                busy = busy or t.is_alive()
+            else:
+                try:
+                    t.result(left)
+                except concurrent.futures.TimeoutError:
+                    t.cancel()
+                    busy = True
+                except Exception:
+                    pass
+        while (any(c.isbusy() for c in crons)
+               and time.monotonic() < deadline):
+            time.sleep(0.1)
+        if busy or any(c.isbusy() for c in crons):
+            logger.warning('Module %s did not stop. Not closing it.',
+                           pud.config.name(mod.config))
+            return
+        self.close(mod)
+
+    # Runs target in a thread which is waited for by stop().
+    def background(self, name, target):
+        self.stopping = [t for t in self.stopping if t.is_alive()]
+        t = threading.Thread(target=target, daemon=True, name=name)
+        t.start()
+        self.stopping.append(t)
+
+    def close(self, mod):
+        if not hasattr(mod, 'close'):
+            return
         try:
-            mod_cls = module(name)
-            mod = mod_cls(term=term, logger=get_logger(name), config=cfg)
+            if pud.aio.iscoroutine(mod.close):
+                self.executor(mod.close).call(mod.close, timeout=5)
+            else:
+                mod.close()
+        except Exception as e:
+            logger.exception('Closing %s failed.', mod)
+
+    # Runs crons till the daemon is terminated, configuration reload is
+    # requested or a module is loaded in background. The next firing is
+    # kept in the queue, so it is not lost if run() is called again.
+    def run(self):
+        while True:
+            wakeup.clear()
+            if term.is_set() or hup.is_set() or not loaded.empty():
+                return
+            head = self.runq.peek()
+            if head is None:
+                wakeup.wait()
+                continue
+
+            c, runtime = head
+            left = runtime - time.time()
+            if left > 0:
+                logger.info('Sleeping for %d seconds till the next run of %s.',
+                             left, c.name)
+                if wakeup.wait(left):
+                    continue
+            self.runq.next()
+
+            if c.isexpired(runtime):
+                c.stats.inc('expired')
+                logger.warning('Cron task %s missed its run time. Skipping.',
+                               c.name)
+            else:
+                c.fire(runtime)
+
+    def stop(self):
+        for mod in self.mods:
+            mod.term.set()
+        for t in self.stopping:
+            t.join()
+        busy = set()
+        for meth, t in self.tasks.items():
+            if isinstance(t, threading.Thread) and t.is_alive():
+                logging.info('Waiting for %s to exit.', taskname(meth))
+                t.join(5)
+                if t.is_alive():
+                    logging.warn('%s did not exited. Ignoring.',
+                                 taskname(meth))
+                    busy.add(meth.__self__)
+        self.pool.close(5)
+        if self.aio is not None:
+            self.aio.call(self.aio.drain, 5)
+        for c in self.crons:
+            if c.isbusy():
+                busy.add(c.method.__self__)
+
+        for mod in self.mods:
+            if mod not in busy:
+                self.close(mod)
+        if self.aio is not None:
+            self.aio.close(5)
+        if self.graphite is not None:
+            self.graphite.close()
+
+
+# Module instance is either a module object scheduled in this process or
+# a pud.worker.Worker running it in a child process.
+def load(cfg, daemon_cfg):
+    name = pud.config.name(cfg)
+    if isprocess(cfg):
+        logger.info('Starting %s module in a separate process.', name)
+        return pud.worker.Worker(cfg, daemon_cfg)
+
+    logger.info('Initializing %s module.', name)
+    return load_module(cfg, get_logger(name))
+
+
+# Loads module in a separate thread, so slow module initialization does
+# not delay others. The result is put to `loaded` queue.
+def load_async(cfg, daemon_cfg):
+    def target():
+        start = time.monotonic()
+        inst = err = None
+        try:
+            inst = load(cfg, daemon_cfg)
+        except Exception as e:
+            err = e
+        loaded.put((cfg, inst, time.monotonic() - start, err))
+        wakeup.set()
+
+    threading.Thread(target=target, daemon=True,
+                     name='load-{}'.format(pud.config.name(cfg))).start()
+
+
+# Starts module loaded by load_async(). Loading errors are fatal during
+# startup and are only logged for modules loaded after it. A module
+# reloaded after startup replaces its running instance, so if loading
+# fails the old instance keeps running.
+def start_loaded(sched, running, loading, cfg, inst, secs, err, fatal):
+    name = pud.config.name(cfg)
+    if cfg.path not in loading:
+        logger.info('Module %s was removed while loading. Not starting it.',
+                    name)
+        if err is None and not isinstance(inst, pud.worker.Worker):
+            sched.background('stop-' + name, lambda: sched.close(inst))
+        return
+    loading.discard(cfg.path)
+    old = running.get(cfg.path)
+    if err is None:
+        if old is not None:
+            logger.info('Restarting %s module.', name)
+            stop(sched, running.pop(cfg.path))
+        try:
+            start(sched, inst)
         except (PudError, pud.config.ConfigurationError) as e:
-            die('Module %s loading failed: %s', name, e)
+            err = e
+    if err is not None:
+        if not fatal:
+            logger.error('Module %s loading failed: %s', name, err)
+            return
+        if isinstance(err, (PudError, pud.config.ConfigurationError)):
+            die('Module %s loading failed: %s', name, err)
+        raise err
+
+    running[cfg.path] = inst
+    logger.info('Module %s loaded in %.3f seconds.', name, secs)
+
+
+def start(sched, inst):
+    if isinstance(inst, pud.worker.Worker):
+        inst.start()
+    else:
+        sched.add(inst)
 
-        for meth in module_tasks(mod):
-            tasks.append(meth)
-            logger.info('Registered %s long task.', meth)
 
-        for meth, expr in module_crons(mod).items():
-            try:
-                crons[meth] = croniter.croniter(expr)
-                logger.info('Registered %s cron task.', meth)
-            except croniter.CroniterBadCronError as e:
-                die('Parsing cron expression for %s failed: %s', meth, e)
+# Stops the instance without waiting for it to exit.
+def stop(sched, inst):
+    if isinstance(inst, pud.worker.Worker):
+        sched.background('stop-' + inst.name, lambda: inst.stop(5))
+    else:
+        sched.remove(inst)
 
-    running = {}
 
-    for task in tasks:
-        logger.info('Executing long task %s', task)
-        t = TaskThread(target=task)
-        t.start()
-        running[task] = t
+def instance_config(inst):
+    if isinstance(inst, pud.worker.Worker):
+        return inst.cfg
 
-    if crons:
-        runq = RunQueue(crons)
+    return inst.config
 
-        while not term.is_set():
-            meth, runtime = runq.next()
-            left = runtime - time.time()
 
-            if left > 0:
-                logger.info('Sleeping for %d seconds till the next run of %s.',
-                             left, meth)
-                if term.wait(left):
-                    break
+# Re-reads modules configuration and restarts only modules which
+# configuration files were added, removed or changed. New instances are
+# loaded in background and replace old ones once loaded (see
+# start_loaded()), so neither slow loading nor stopping blocks the
+# scheduler.
+def reload(sched, daemon_cfg, running, loading):
+    try:
+        cfg = pud.config.load_config(os.path.join(CONFIG_DIR, 'pud.conf'))
+        cfgs = pud.config.load_configs(os.path.join(CONFIG_DIR, 'modules'))
+        check_names(cfgs)
+        check_owned(cfgs)
+    except (OSError, PudError, pud.config.SyntaxError,
+            pud.config.ConfigurationError) as e:
+        logger.error('Reloading configuration failed: %s', e)
+        return
+    if cfg != daemon_cfg:
+        logger.warning('pud.conf changes are applied after restart only.')
+
+    cfgs = {c.path: c for c in cfgs}
+    stopped = reloading = 0
+    for path in list(loading):
+        if path not in cfgs:
+            loading.discard(path)
+    for path in list(running):
+        if path not in cfgs:
+            logger.info('Stopping %s module.',
+                        pud.config.name(instance_config(running[path])))
+            stop(sched, running.pop(path))
+            stopped += 1
+    for path, cfg in cfgs.items():
+        if path in loading:
+            logger.warning('Module %s is still loading. Not reloading it.',
+                           pud.config.name(cfg))
+            continue
+        old = running.get(path)
+        if old is not None and instance_config(old) == cfg:
+            continue
+        loading.add(path)
+        load_async(cfg, daemon_cfg)
+        reloading += 1
+
+    logger.info('Configuration reloaded. %d modules stopped, %d loading.',
+                stopped, reloading)
 
-            for c in crons.keys():
-                if c in running and not running[c].is_alive():
-                    del running[c]
 
-            if not isexpired(runtime) and meth not in running:
-                logger.info('Executing cron task %s', meth)
-                t = CronThread(target=meth)
-                t.start()
-                running[meth] = t
-    else:
-        term.wait(3153600000)
-
-    for meth, t in running.items():
-        if t.is_alive():
-            logging.info('Waiting for %s to exit.', meth)
-            t.join(5)
-            if t.is_alive():
-                logging.warn('%s did not exited. Ignoring.', meth)
-            else:
-                mod = meth.__self__
-                if hasattr(mod, 'close'):
-                    mod.close()
+def run():
+    logging.basicConfig(format=LOGGER_FORMAT, level=LOGGER_LEVEL)
+    get_logger()
+    logger.info('Starging.')
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    signal.signal(signal.SIGHUP, on_sighup)
+    signal.signal(signal.SIGUSR1, pud.profile.on_sigusr1)
+    signal.signal(signal.SIGUSR2, pud.profile.on_sigusr2)
+
+    try:
+        daemon_cfg = pud.config.load_config(
+            os.path.join(CONFIG_DIR, 'pud.conf'))
+        cfgs = pud.config.load_configs(os.path.join(CONFIG_DIR, 'modules'))
+    except pud.config.SyntaxError as e:
+        die('Loading configuration failed: %s', e)
+
+    try:
+        check_names(cfgs)
+        check_owned(cfgs)
+        pud.spool.configure(daemon_cfg)
+        pud.metrics.configure(daemon_cfg)
+        pud.profile.configure(daemon_cfg)
+        sched = Scheduler(daemon_cfg)
+    except (PudError, pud.config.ConfigurationError) as e:
+        die('Loading configuration failed: %s', e)
+
+    try:
+        timeout = pud.config.get(daemon_cfg, 'startup.timeout', int,
+                                 STARTUP_TIMEOUT)
+    except pud.config.ConfigurationError as e:
+        die('Loading configuration failed: %s', e)
+
+    # Modules are loaded in parallel. Those not loaded till the startup
+    # timeout are started later, once loaded, not delaying others.
+    started = time.monotonic()
+    running = {}
+    loading = set()
+    for cfg in cfgs:
+        loading.add(cfg.path)
+        load_async(cfg, daemon_cfg)
+    while loading:
+        left = started + timeout - time.monotonic()
+        try:
+            r = loaded.get(timeout=max(0, left))
+        except queue.Empty:
+            break
+        start_loaded(sched, running, loading, *r, fatal=True)
+    logger.info('Started %d modules in %.3f seconds.',
+                len(running), time.monotonic() - started)
+    if loading:
+        logger.warning('%d modules are not loaded in %d seconds. '
+                       'Starting them once loaded.', len(loading), timeout)
+
+    while True:
+        sched.run()
+        if term.is_set():
+            break
+        while not loaded.empty():
+            start_loaded(sched, running, loading, *loaded.get(),
+                         fatal=False)
+        if hup.is_set():
+            hup.clear()
+            reload(sched, daemon_cfg, running, loading)
+
+    sched.stop()
+    for inst in running.values():
+        if isinstance(inst, pud.worker.Worker):
+            inst.stop(5)
+    pud.worker.close()
+    pud.metrics.close()
+    pud.storage.close()
+    pud.profile.close()
 
     logging.shutdown()
@@ -0,0 +1,94 @@
+import time
+import threading
+import concurrent.futures
+
+
+sources = {}
+lock = threading.Lock()
+
+
+# Named connection shared by all modules of the process which poll the
+# same service. Query results are cached for ttl seconds and identical
+# queries issued while one is in progress wait for its result instead of
+# calling the service again. Queries run one at a time, so the connection
+# object does not have to be thread-safe. Failed results are not cached.
+class Source:
+    def __init__(self, name, conn):
+        self.name = name
+        self.conn = conn
+        self.refs = 0
+        self.lock = threading.Lock()
+        self.connlock = threading.Lock()
+        self.results = {}
+        self.calls = 0
+        self.hits = 0
+
+    def query(self, key, func, ttl):
+        now = time.monotonic()
+        with self.lock:
+            r = self.results.get(key)
+            if r is not None and (not r[1].done() or now - r[0] < ttl):
+                self.hits += 1
+                f = r[1]
+            else:
+                f = concurrent.futures.Future()
+                self.results[key] = (now, f)
+                self.calls += 1
+                r = None
+        if r is not None:
+            return f.result()
+
+        try:
+            with self.connlock:
+                v = func(self.conn)
+        except BaseException as e:
+            with self.lock:
+                if self.results.get(key, (0, None))[1] is f:
+                    del self.results[key]
+            f.set_exception(e)
+            raise
+        f.set_result(v)
+
+        return v
+
+    # Returns numbers of service calls and queries answered from the cache
+    # or by a call in progress.
+    def stats(self):
+        with self.lock:
+            return [('calls', self.calls), ('hits', self.hits)]
+
+    def close(self):
+        with self.connlock:
+            if self.conn is not None:
+                self.conn.close()
+
+
+# Returns source with the given name creating its connection with factory
+# if it does not exist yet. Every acquire must be paired with release.
+# The factory is called outside of the registry lock, so a slow connect
+# does not block acquiring other sources.
+def acquire(name, factory):
+    with lock:
+        s = sources.get(name)
+        if s is None:
+            s = sources[name] = Source(name, None)
+        s.refs += 1
+
+    try:
+        with s.connlock:
+            if s.conn is None:
+                s.conn = factory()
+    except BaseException:
+        release(s)
+        raise
+
+    return s
+
+
+def release(source):
+    with lock:
+        source.refs -= 1
+        if source.refs > 0:
+            return
+        sources.pop(source.name, None)
+    source.close()
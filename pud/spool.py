@@ -0,0 +1,175 @@
+import os
+import time
+import struct
+import pickle
+import logging
+import threading
+import pud.config
+
+
+DIR = '/var/lib/pud/spool'
+SIZE = 100
+AGE = 7 * 24 * 3600
+REPLAY = 10
+SEGMENT_SIZE = 1024 * 1024
+FRAME = struct.Struct('!L')
+
+logger = logging.getLogger('pud')
+
+defaults = pud.config.Config(None)
+process = 'main'
+
+
+# Append-only on-disk queue of records which could not be delivered to a
+# sink. Records are pickled and stored in segment files of about
+# SEGMENT_SIZE bytes. Oldest segments are dropped when the spool exceeds
+# its size or age limit.
+class Spool:
+    def __init__(self, path, size, age, replay):
+        self.path = path
+        self.size = size
+        self.age = age
+        self.limit = replay
+        self.lock = threading.Lock()
+        self.replaymu = threading.Lock()
+        self.seq = 0
+        self.segment = None
+
+    def __str__(self):
+        return self.path or 'disabled spool'
+
+    def append(self, records):
+        if self.path is None:
+            logger.warning('Spool is disabled. Dropping %d records.',
+                           len(records))
+            return
+
+        data = b''.join(FRAME.pack(len(d)) + d
+                        for d in (pickle.dumps(r) for r in records))
+        with self.lock:
+            try:
+                if self.segment is None or self.segment.tell() > SEGMENT_SIZE:
+                    self.rotate()
+                self.segment.write(data)
+                self.segment.flush()
+            except OSError as e:
+                logger.error('Writing to %s failed: %s', self, e)
+            self.trim()
+
+    def rotate(self):
+        self.close()
+        self.seq += 1
+        name = '{:020d}-{:06d}.seg'.format(time.time_ns(), self.seq)
+        self.segment = open(os.path.join(self.path, name), 'ab')
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def segments(self):
+        return sorted(f for f in os.listdir(self.path) if f.endswith('.seg'))
+
+    def trim(self):
+        segs = self.segments()
+        sizes = [os.path.getsize(os.path.join(self.path, s)) for s in segs]
+        total = sum(sizes)
+        minns = (time.time() - self.age) * 1e9
+        cur = self.segment and os.path.basename(self.segment.name)
+        for s, sz in zip(segs, sizes):
+            if s == cur or total <= self.size and int(s[:20]) >= minns:
+                break
+            os.remove(os.path.join(self.path, s))
+            total -= sz
+            logger.warning('Spool segment %s dropped due to size or age '
+                           'limit.', os.path.join(self.path, s))
+
+    # Passes spooled records to send() in batches of up to `batch` records,
+    # oldest first, at most `limit` (self.limit by default) times per call.
+    # Stops at the first send() failure keeping undelivered records.
+    # Returns True if the spool got empty.
+    def replay(self, send, batch=1, limit=None):
+        if self.path is None:
+            return True
+        if limit is None:
+            limit = self.limit
+
+        with self.replaymu:
+            with self.lock:
+                self.close()
+                segs = self.segments()
+
+            calls = 0
+            for s in segs:
+                path = os.path.join(self.path, s)
+                records = read(path)
+                sent = 0
+                try:
+                    while sent < len(records) and calls < limit:
+                        send(records[sent:sent + batch])
+                        sent += batch
+                        calls += 1
+                finally:
+                    if 0 < sent < len(records):
+                        write(path, records[sent:])
+                if sent < len(records):
+                    return False
+                os.remove(path)
+                logger.info('Spool segment %s replayed.', path)
+
+        return True
+
+
+def read(path):
+    records = []
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    i = 0
+    while i + FRAME.size <= len(data):
+        n, = FRAME.unpack_from(data, i)
+        i += FRAME.size
+        if i + n > len(data):
+            logger.warning('Truncated record in spool segment %s.', path)
+            break
+        records.append(pickle.loads(data[i:i + n]))
+        i += n
+
+    return records
+
+
+def write(path, records):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        for r in records:
+            d = pickle.dumps(r)
+            f.write(FRAME.pack(len(d)) + d)
+    os.replace(tmp, path)
+
+
+def configure(daemon_cfg, proc='main'):
+    global defaults, process
+    defaults = daemon_cfg
+    process = proc
+
+
+# Returns spool with the given name configured with the daemon-wide
+# spool.* properties. Every process keeps its spools in a separate
+# directory. If the spool is disabled or its directory cannot be
+# created returned spool drops everything appended to it.
+def spool(name):
+    if not pud.config.get(defaults, 'spool', bool, True):
+        return Spool(None, 0, 0, 0)
+
+    path = os.path.join(pud.config.get(defaults, 'spool.dir', str, DIR),
+                        process, name)
+    size = pud.config.get(defaults, 'spool.size', int, SIZE) * 1024 * 1024
+    age = pud.config.get(defaults, 'spool.age', int, AGE)
+    replay = pud.config.get(defaults, 'spool.replay', int, REPLAY)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as e:
+        logger.error('Creating spool %s failed: %s', path, e)
+        return Spool(None, 0, 0, 0)
+
+    return Spool(path, size, age, replay)
@@ -0,0 +1,172 @@
+import queue
+import sqlite3
+import threading
+import concurrent.futures
+
+
+PRAGMAS = ['PRAGMA journal_mode=WAL',
+           'PRAGMA synchronous=NORMAL',
+           'PRAGMA temp_store=MEMORY',
+           'PRAGMA busy_timeout=5000']
+# Maximum number of statements grouped into a single transaction.
+BATCH = 1000
+
+databases = {}
+writer = None
+lock = threading.Lock()
+
+
+class Job:
+    def __init__(self, db, sql, params, many=False, query=False):
+        self.db = db
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.query = query
+        self.future = concurrent.futures.Future()
+
+    def run(self, conn):
+        if self.many:
+            conn.executemany(self.sql, self.params)
+            return None
+        cur = conn.execute(self.sql, self.params)
+
+        return cur.fetchall() if self.query else None
+
+
+# The only thread which touches SQLite connections. Statements queued by
+# all modules are grouped by database and executed in a single transaction
+# per database.
+class Writer(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True, name='storage')
+        self.jobs = queue.SimpleQueue()
+        self.conns = {}
+
+    def submit(self, job):
+        self.jobs.put(job)
+
+        return job.future
+
+    def run(self):
+        while True:
+            jobs = [self.jobs.get()]
+            while len(jobs) < BATCH:
+                try:
+                    jobs.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in jobs
+            groups = {}
+            for j in jobs:
+                if j is not None:
+                    groups.setdefault(j.db, []).append(j)
+            for db, js in groups.items():
+                self.execute(db, js)
+            if stop:
+                break
+
+        for conn in self.conns.values():
+            conn.close()
+
+    def conn(self, path):
+        if path not in self.conns:
+            conn = sqlite3.connect(path, isolation_level=None)
+            for p in PRAGMAS:
+                conn.execute(p)
+            self.conns[path] = conn
+
+        return self.conns[path]
+
+    def execute(self, path, jobs):
+        try:
+            conn = self.conn(path)
+        except sqlite3.Error as e:
+            for j in jobs:
+                j.future.set_exception(e)
+            return
+
+        results = []
+        try:
+            conn.execute('BEGIN')
+            for j in jobs:
+                results.append(j.run(conn))
+            conn.execute('COMMIT')
+        except Exception as e:
+            rollback(conn)
+            # Find out the failed statement running them one by one.
+            for j in jobs:
+                self.execute_one(conn, j)
+            return
+
+        for j, r in zip(jobs, results):
+            j.future.set_result(r)
+
+    def execute_one(self, conn, job):
+        try:
+            conn.execute('BEGIN')
+            r = job.run(conn)
+            conn.execute('COMMIT')
+        except Exception as e:
+            rollback(conn)
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(r)
+
+    def stop(self):
+        self.jobs.put(None)
+        self.join()
+
+
+def rollback(conn):
+    if conn.in_transaction:
+        conn.execute('ROLLBACK')
+
+
+# Shared handle of a single SQLite database. All methods are thread-safe.
+# With wait=False execute methods return a Future instead of waiting for
+# the statement to be committed.
+class Database:
+    def __init__(self, path):
+        self.path = path
+
+    def execute(self, sql, params=(), wait=True):
+        f = get_writer().submit(Job(self.path, sql, params))
+
+        return f.result() if wait else f
+
+    def executemany(self, sql, params, wait=True):
+        f = get_writer().submit(Job(self.path, sql, list(params), many=True))
+
+        return f.result() if wait else f
+
+    def query(self, sql, params=()):
+        return get_writer().submit(Job(self.path, sql, params,
+                                       query=True)).result()
+
+
+def get_writer():
+    global writer
+    with lock:
+        if writer is None:
+            writer = Writer()
+            writer.start()
+
+        return writer
+
+
+def open(path):
+    with lock:
+        if path not in databases:
+            databases[path] = Database(path)
+
+        return databases[path]
+
+
+def close():
+    global writer
+    with lock:
+        w, writer = writer, None
+    if w is not None:
+        w.stop()
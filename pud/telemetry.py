@@ -0,0 +1,114 @@
+import bisect
+import threading
+import pud.config
+import pud.metrics
+
+
+# Histogram buckets upper bounds in seconds.
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.count += 1
+        self.sum += v
+        self.max = max(self.max, v)
+
+    def items(self):
+        items = [('count', self.count), ('sum', self.sum), ('max', self.max)]
+        for b, c in zip(self.buckets, self.counts):
+            items.append(('le_{}'.format(str(b).replace('.', '_')), c))
+        items.append(('le_inf', self.counts[-1]))
+
+        return items
+
+
+# Counters of a single cron or long task. All of them grow monotonically
+# since the daemon start, except max values of the histograms.
+class TaskStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lag = Histogram()
+        self.duration = Histogram()
+        self.success = 0
+        self.failure = 0
+        self.expired = 0
+        self.skipped = 0
+        self.postponed = 0
+        self.retries = 0
+
+    def started(self, lag):
+        with self.lock:
+            self.lag.observe(max(lag, 0))
+
+    def finished(self, duration, ok):
+        with self.lock:
+            self.duration.observe(duration)
+            if ok:
+                self.success += 1
+            else:
+                self.failure += 1
+
+    def inc(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def items(self):
+        with self.lock:
+            items = [('success', self.success),
+                     ('failure', self.failure),
+                     ('expired', self.expired),
+                     ('skipped', self.skipped),
+                     ('postponed', self.postponed),
+                     ('retries', self.retries)]
+            for n, h in (('lag', self.lag), ('duration', self.duration)):
+                items.extend(('{}.{}'.format(n, k), v) for k, v in h.items())
+
+        return items
+
+
+tasks = {}
+tasksmu = threading.Lock()
+
+
+def task(name):
+    with tasksmu:
+        if name not in tasks:
+            tasks[name] = TaskStats()
+
+        return tasks[name]
+
+
+def metrics(pool):
+    with tasksmu:
+        ts = list(tasks.items())
+
+    items = [('threads', threading.active_count()),
+             ('workers', pool.workers_count()),
+             ('workers_busy', pool.busy_count())]
+    for name, st in ts:
+        items.extend(('tasks.{}.{}'.format(name, n), v)
+                     for n, v in st.items())
+
+    return items
+
+
+# Starts sending scheduler metrics to Graphite if graphite.host is set in
+# the daemon configuration. Every process uses own metrics path, as
+# <graphite.prefix>.pud.<process>.
+def publish(daemon_cfg, process, pool):
+    if pud.config.get(daemon_cfg, 'graphite.host', str) is None:
+        return None
+
+    graphite = pud.metrics.graphite(daemon_cfg)
+    graphite.gauges('pud.{}'.format(process), lambda: metrics(pool))
+
+    return graphite
@@ -0,0 +1,172 @@
+import sys
+import time
+import signal
+import logging
+import logging.handlers
+import threading
+import pud.pud
+import pud.config
+import pud.metrics
+import pud.storage
+import pud.spool
+import pud.profile
+
+
+BACKOFF_MIN = 1
+BACKOFF_MAX = 60
+
+ctx = None
+logq = None
+listener = None
+
+
+# Passes log records received from worker processes to the parent's
+# loggers of the same name, so they end up in the same log files.
+class Forwarder(logging.Handler):
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+# multiprocessing is imported only if a module runs in a separate process.
+def context():
+    global ctx
+    if ctx is None:
+        import multiprocessing
+        ctx = multiprocessing.get_context('spawn')
+
+    return ctx
+
+
+def log_queue():
+    global logq, listener
+    if logq is None:
+        logq = context().Queue()
+        listener = logging.handlers.QueueListener(logq, Forwarder())
+        listener.start()
+
+    return logq
+
+
+def close():
+    if listener is not None:
+        listener.stop()
+
+
+# Supervises a module running in a child process. The process is restarted
+# with exponential backoff if it dies or fails to initialize the module.
+class Worker:
+    def __init__(self, cfg, daemon_cfg):
+        self.cfg = cfg
+        self.daemon_cfg = daemon_cfg
+        self.name = pud.config.name(cfg)
+        self.proc = None
+        self.conn = None
+        self.stopping = threading.Event()
+        self.supervisor = None
+        pud.pud.get_logger(self.name)
+
+    def start(self):
+        self.spawn()
+        self.supervisor = threading.Thread(target=self.supervise, daemon=True,
+                                           name='supervisor-' + self.name)
+        self.supervisor.start()
+
+    def spawn(self):
+        self.conn, conn = context().Pipe(duplex=False)
+        self.proc = context().Process(target=main,
+                                      args=(self.cfg, self.daemon_cfg,
+                                            log_queue(), conn),
+                                      name='pud-' + self.name)
+        self.proc.start()
+        conn.close()
+
+    def supervise(self):
+        backoff = BACKOFF_MIN
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            self.watch()
+            if self.stopping.is_set() or pud.pud.term.is_set():
+                break
+
+            pud.pud.logger.error('Module %s process exited with code %s. '
+                                 'Restarting in %d seconds.',
+                                 self.name, self.proc.exitcode, backoff)
+            if time.monotonic() - started > BACKOFF_MAX:
+                backoff = BACKOFF_MIN
+            if self.stopping.wait(backoff):
+                break
+            backoff = min(backoff * 2, BACKOFF_MAX)
+            self.spawn()
+
+    def watch(self):
+        import multiprocessing.connection
+        sentinel = self.proc.sentinel
+        waitfor = [self.conn, sentinel]
+        while True:
+            for r in multiprocessing.connection.wait(waitfor):
+                if r is sentinel:
+                    self.proc.join()
+                    return
+                try:
+                    self.status(*self.conn.recv())
+                except EOFError:
+                    waitfor.remove(self.conn)
+
+    def status(self, status, msg):
+        if status == 'ready':
+            pud.pud.logger.info('Module %s process %d is ready: %s.',
+                                self.name, self.proc.pid, msg)
+        else:
+            pud.pud.logger.error('Module %s process %d failed: %s',
+                                 self.name, self.proc.pid, msg)
+
+    def stop(self, timeout):
+        self.stopping.set()
+        if self.proc.is_alive():
+            pud.pud.logger.info('Waiting for %s process to exit.', self.name)
+            self.proc.terminate()
+            self.proc.join(timeout)
+            if self.proc.is_alive():
+                pud.pud.logger.warning('%s process did not exited. Killing.',
+                                       self.name)
+                self.proc.kill()
+                self.proc.join()
+        self.supervisor.join(timeout)
+
+
+def main(cfg, daemon_cfg, logq, conn):
+    root = logging.getLogger()
+    for lg in (root, pud.pud.logger):
+        for h in list(lg.handlers):
+            lg.removeHandler(h)
+            h.close()
+    root.addHandler(logging.handlers.QueueHandler(logq))
+    root.setLevel(pud.pud.LOGGER_LEVEL)
+
+    signal.signal(signal.SIGTERM, pud.pud.on_sigterm)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Configuration is reloaded by the parent which restarts the process.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, pud.profile.on_sigusr1)
+    signal.signal(signal.SIGUSR2, pud.profile.on_sigusr2)
+
+    name = pud.config.name(cfg)
+    try:
+        pud.spool.configure(daemon_cfg, name)
+        pud.metrics.configure(daemon_cfg)
+        pud.profile.configure(daemon_cfg, name)
+        sched = pud.pud.Scheduler(daemon_cfg, name)
+        sched.add(pud.pud.load_module(cfg, logging.getLogger(name)))
+    except Exception as e:
+        pud.pud.logger.exception('Module %s loading failed.', name)
+        conn.send(('error', str(e)))
+        sys.exit(1)
+
+    conn.send(('ready', '{} cron tasks, {} long tasks'.format(
+        len(sched.crons), len(sched.tasks))))
+    sched.run()
+    sched.stop()
+    pud.metrics.close()
+    pud.storage.close()
+    pud.profile.close()
+    conn.close()